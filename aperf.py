@@ -0,0 +1,180 @@
+import os
+import threading
+from typing import Callable, Literal
+
+import numpy as np
+
+from constants import APERF_TABLE
+from history import CompetitionHistory
+
+# Hệ số giảm dần của performance trung bình: 0.9^1, 0.9^2, ... tính từ contest gần nhất
+DECAY = 0.9
+
+
+# Performance trung bình của 1 user: sum(0.9^i * perf_i) / sum(0.9^i), perf_1 là contest gần nhất
+# Return None nếu user chưa thi contest nào
+def decayed_average(perfs: list[float]) -> float | None:
+    if len(perfs) == 0:
+        return None
+
+    numerator: float = 0
+    denominator: float = 0
+    for i, perf in enumerate(reversed(perfs)):
+        numerator += pow(DECAY, i + 1) * perf
+        denominator += pow(DECAY, i + 1)
+    return numerator / denominator
+
+
+# Cập nhật performance trung bình khi có thêm 1 contest mới mà không cần duyệt lại lịch sử
+# sum(0.9^i) với k contest = 9 * (1 - 0.9^k)
+def next_decayed_average(aperf: float, count: int, perf: float) -> float:
+    if count == 0:
+        return perf
+    denominator = 9 * (1 - pow(DECAY, count))
+    return DECAY * (perf + aperf * denominator) / (9 * (1 - pow(DECAY, count + 1)))
+
+
+class AperfTable:
+    """
+    Bảng username -> (aperf, số contest đã thi) của 1 contest_type, lưu thành 1 file .npy
+    Sắp xếp theo username, load bằng memory map nên tra aperf của cả contest chỉ cần 1 lần đọc file
+    Được cập nhật mỗi khi lịch sử thi đấu thay đổi (sau khi có kết quả cuối cùng của contest)
+    """
+
+    DTYPE = np.dtype([("username", "U32"), ("aperf", "f8"), ("count", "i4")])
+    # Ghi file từ nhiều thread cùng lúc sẽ làm mất cập nhật
+    lock = threading.Lock()
+
+    def __init__(self, contest_type: Literal["algo", "heuristic"]):
+        self.contest_type = contest_type
+        self.file = APERF_TABLE.format(contest_type)
+
+    def _load(self) -> np.ndarray:
+        if not os.path.exists(self.file):
+            return np.empty(0, dtype=self.DTYPE)
+        return np.load(self.file, mmap_mode="r")
+
+    def lookup(self, usernames: list[str]) -> dict[str, tuple[float, int]]:
+        """
+        @return {username: (aperf, count)}, user chưa có trong bảng sẽ không có trong kết quả
+        aperf là nan nếu count = 0
+        """
+        table = self._load()
+        if len(table) == 0 or len(usernames) == 0:
+            return {}
+        keys = np.asarray(usernames, dtype=self.DTYPE["username"])
+        idx = np.minimum(np.searchsorted(table["username"], keys), len(table) - 1)
+        rows = table[idx]
+        found = rows["username"] == keys
+        return {
+            username: (float(row["aperf"]), int(row["count"]))
+            for username, row, ok in zip(usernames, rows, found)
+            if ok
+        }
+
+    def upsert(self, entries: dict[str, tuple[float, int]]) -> None:
+        if len(entries) == 0:
+            return
+        with AperfTable.lock:
+            table = self._load()
+            updated = np.array(
+                [
+                    (username, aperf, count)
+                    for username, (aperf, count) in entries.items()
+                ],
+                dtype=self.DTYPE,
+            )
+            kept = table[~np.isin(table["username"], updated["username"])]
+            merged = np.concatenate([kept, updated])
+            merged.sort(order="username")
+
+            os.makedirs(os.path.dirname(self.file), exist_ok=True)
+            tmp = f"{self.file}.tmp.npy"
+            np.save(tmp, merged)
+            # Ghi ra file tạm rồi rename, bảng đang được memory map vẫn đọc được
+            os.replace(tmp, self.file)
+
+    @staticmethod
+    def entry(history: CompetitionHistory) -> tuple[float, int]:
+        perfs = history.inner_performance
+        aperf = decayed_average(perfs)
+        return (np.nan if aperf is None else aperf, len(perfs))
+
+
+class AperfState:
+    """
+    aperf của toàn bộ rated participant trong 1 contest, được giữ lại giữa các lần chạy generate_performance_files
+    Mỗi lần chạy chỉ tính aperf cho user mới tham gia, user đã rời đi thì bị loại ra
+    forget() được gọi từ thread khác (warmer) nên mọi thay đổi đều giữ lock
+    """
+
+    participants: list[str]  # sorted
+    aperfs: np.ndarray  # aperfs[i] is the aperf of participants[i]
+
+    def __init__(self):
+        self.participants = []
+        self.aperfs = np.empty(0)
+        self._aperf_by_username: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def update(
+        self,
+        participants: list[str],
+        average_inner_performances: Callable[[list[str]], list[float]],
+    ) -> np.ndarray:
+        """
+        participants: sorted usernames of the current standings
+        average_inner_performances: computes the aperfs of the users who are not known yet
+        @return aperfs in the same order as participants
+        """
+        with self._lock:
+            current = set(participants)
+            left = [
+                username
+                for username in self._aperf_by_username
+                if username not in current
+            ]
+            joined = [
+                username
+                for username in participants
+                if username not in self._aperf_by_username
+            ]
+            if len(left) == 0 and len(joined) == 0:
+                return self.aperfs
+
+            print(f"{len(joined)} users joined, {len(left)} users left")
+            for username in left:
+                del self._aperf_by_username[username]
+            self._aperf_by_username.update(
+                zip(joined, average_inner_performances(joined))
+            )
+
+            self.participants = participants
+            self.aperfs = np.array(
+                [self._aperf_by_username[username] for username in participants],
+                dtype=np.float64,
+            )
+            return self.aperfs
+
+    def forget(self, usernames: list[str]) -> None:
+        """
+        Bỏ aperf đang nhớ của các user, lần update sau sẽ tính lại như user mới tham gia
+        """
+        with self._lock:
+            for username in usernames:
+                self._aperf_by_username.pop(username, None)
+
+
+if __name__ == "__main__":
+    # Tạo lại bảng aperf từ toàn bộ lịch sử thi đấu đã lưu
+    from history_store import history_store
+
+    for contest_type in ["algo", "heuristic"]:
+        histories = history_store().load_all(contest_type)
+        print(f"Rebuilding {contest_type} aperf table of {len(histories)} users")
+        AperfTable(contest_type).upsert(
+            {
+                username: AperfTable.entry(history)
+                for username, history in histories.items()
+            }
+        )
@@ -0,0 +1,316 @@
+"""
+Benchmark các bước tạo dữ liệu dự đoán mà không cần truy cập mạng
+Dữ liệu: lịch sử thi đấu dựng lại từ data/{contest}_rounded_perf_history.json và contest giả 5k/15k/30k user
+Mỗi contest chạy trong 1 thư mục tạm riêng (store, bảng aperf, file output), không đụng tới dữ liệu thật
+
+python benchmark.py
+python benchmark.py --contests abc461 ahc050 --sizes 5000 --output before.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from aperf import AperfState
+from constants import ALL_PARTICIPANTS_ROUNDED_PERF_HISTORY, CONTEST_TYPE_DUMP
+from contest import Contest, Standings
+from history import CompetitionHistory
+from history_store import history_store
+from user import User, competition_histories
+
+DEFAULT_CONTESTS = ["abc461", "abc466"]
+DEFAULT_SIZES = [5000, 15000, 30000]
+SEED = 20250101
+
+
+def _contest(short_name: str, contest_type: str) -> Contest:
+    if contest_type == "algo":
+        return Contest(
+            "2025-01-01 21:00:00+0900",
+            f"Ⓐ {short_name}",
+            f"/contests/{short_name}",
+            "01:40",
+            "- 1999",
+        )
+    return Contest(
+        "2025-01-01 19:00:00+0900",
+        f"Ⓗ {short_name}",
+        f"/contests/{short_name}",
+        "04:00",
+        "All",
+    )
+
+
+def _history(perfs: list[int], names: list[str]) -> CompetitionHistory:
+    start = datetime(2020, 1, 1)
+    return CompetitionHistory.from_dict(
+        {
+            "RoundedPerformance": perfs,
+            # Perf vượt giới hạn đã bị làm tròn, coi như inner performance
+            "InnerPerformance": perfs,
+            "ContestEndTime": [
+                (start + timedelta(days=7 * i)).strftime("%Y-%m-%d %H:%M:%S")
+                for i in range(len(perfs))
+            ],
+            "Weight": [1] * len(perfs),
+            "ContestShortName": names,
+        }
+    )
+
+
+# Lịch sử thi đấu của toàn bộ participant của 1 contest đã dump trong data/
+def recorded_histories(short_name: str) -> tuple[str, dict[str, CompetitionHistory]]:
+    with open(CONTEST_TYPE_DUMP.format(short_name), "r") as f:
+        contest_type = json.load(f)["type"]
+    with open(ALL_PARTICIPANTS_ROUNDED_PERF_HISTORY.format(short_name), "r") as f:
+        data = json.load(f)
+
+    histories: dict[str, CompetitionHistory] = {}
+    for username, history in data.items():
+        if contest_type == "algo":
+            perfs = history
+            names = [f"c{i}" for i in range(len(perfs))]
+        else:
+            perfs, names = history
+        histories[username] = _history(perfs, names)
+    return contest_type, histories
+
+
+# Lịch sử thi đấu giả của n user, khoảng 10% là người mới chưa thi contest nào
+def synthetic_histories(n: int) -> dict[str, CompetitionHistory]:
+    rng = random.Random(SEED + n)
+    histories: dict[str, CompetitionHistory] = {}
+    for i in range(n):
+        count = 0 if rng.random() < 0.1 else rng.randint(1, 80)
+        skill = rng.gauss(1200, 700)
+        perfs = [max(1, round(rng.gauss(skill, 250))) for _ in range(count)]
+        histories[f"user{i}"] = _history(perfs, [f"c{j}" for j in range(count)])
+    return histories
+
+
+def _standings(contest_type: str, usernames: list[str]) -> Standings:
+    return Standings(
+        contest_type,
+        {
+            "StandingsData": [
+                {
+                    "UserScreenName": username,
+                    "IsRated": True,
+                    "TotalResult": {"Count": 1},
+                }
+                for username in usernames
+            ]
+        },
+    )
+
+
+def _measure(results: dict, stage: str, users: int, func):
+    """
+    Chạy func 1 lần, ghi lại thời gian, số user/giây và bộ nhớ peak (tracemalloc, gồm cả numpy)
+    Output của func (print, tqdm) bị ẩn đi để report dễ đọc
+    tracemalloc làm code Python chậm đi, chỉ nên so sánh thời gian giữa các lần chạy benchmark với nhau
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    with (
+        contextlib.redirect_stdout(io.StringIO()),
+        contextlib.redirect_stderr(io.StringIO()),
+    ):
+        value = func()
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    results[stage] = {
+        "seconds": round(seconds, 4),
+        "users_per_second": round(users / seconds, 1) if seconds > 0 else None,
+        "peak_memory_mb": round(peak / 1024 / 1024, 2),
+    }
+    print(
+        f"  {stage:<28} {seconds:>9.3f}s {results[stage]['users_per_second'] or 0:>12.0f} users/s {results[stage]['peak_memory_mb']:>9.1f} MB"
+    )
+    return value
+
+
+def benchmark_contest(
+    short_name: str, contest_type: str, histories: dict[str, CompetitionHistory]
+) -> dict:
+    contest = _contest(short_name, contest_type)
+    usernames = sorted(histories)
+    standings = _standings(contest_type, usernames)
+    n = len(usernames)
+    print(f"{short_name} ({contest_type}, {n} users)")
+
+    results: dict[str, dict] = {}
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        os.makedirs("data")
+        history_store.cache_clear()
+        try:
+            _measure(
+                results,
+                "history_write",
+                n,
+                lambda: history_store().upsert_many(contest_type, histories),
+            )
+            _measure(
+                results,
+                "history_load",
+                n,
+                lambda: competition_histories(usernames, contest_type),
+            )
+            _measure(
+                results,
+                "average_inner_performance",
+                n,
+                lambda: [
+                    User(username).average_inner_performance(contest)
+                    for username in usernames
+                ],
+            )
+
+            # Bảng aperf còn trống: tính từ lịch sử thi đấu rồi ghi vào bảng
+            Contest._aperf_states.pop(short_name, None)
+            aperfs = _measure(
+                results,
+                "aperf_cold",
+                n,
+                lambda: contest.get_average_inner_performance_of_all_participants(
+                    standings
+                ),
+            )
+            # Lần chạy tiếp theo với cùng standings
+            _measure(
+                results,
+                "aperf_unchanged",
+                n,
+                lambda: contest.get_average_inner_performance_of_all_participants(
+                    standings
+                ),
+            )
+            # Process mới: bảng aperf đã có đủ user
+            Contest._aperf_states[short_name] = AperfState()
+            _measure(
+                results,
+                "aperf_from_table",
+                n,
+                lambda: contest.get_average_inner_performance_of_all_participants(
+                    standings
+                ),
+            )
+
+            _measure(
+                results,
+                "calculate_performance",
+                n,
+                lambda: contest.calculate_performance_in_contest(
+                    aperfs, save_to_file=False
+                ),
+            )
+            _measure(
+                results,
+                "calculate_performance_exact",
+                n,
+                lambda: contest.calculate_performance_in_contest(
+                    aperfs, save_to_file=False, exact=True
+                ),
+            )
+            _measure(
+                results,
+                f"dump_all_{contest_type}",
+                n,
+                lambda: contest.dump_rounded_performance_history_of_all(standings),
+            )
+            _measure(
+                results,
+                f"dump_all_{contest_type}_sharded",
+                n,
+                lambda: contest.dump_rounded_performance_history_of_all(
+                    standings, sharded=True
+                ),
+            )
+        finally:
+            Contest._aperf_states.pop(short_name, None)
+            history_store().conn.close()
+            history_store.cache_clear()
+            os.chdir(cwd)
+
+    return {
+        "contest": short_name,
+        "type": contest_type,
+        "participants": n,
+        "stages": results,
+    }
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the prediction pipeline offline"
+    )
+    parser.add_argument(
+        "--contests",
+        nargs="*",
+        default=DEFAULT_CONTESTS,
+        help="contests in data/ to replay",
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="*",
+        type=int,
+        default=DEFAULT_SIZES,
+        help="numbers of participants of the synthetic contests",
+    )
+    parser.add_argument(
+        "--output",
+        default=f"benchmark-results/{datetime.now().strftime('%Y%m%d-%H%M%S')}.json",
+        help="JSON file to save the results to",
+    )
+    args = parser.parse_args()
+
+    runs = []
+    for short_name in args.contests:
+        contest_type, histories = recorded_histories(short_name)
+        runs.append(benchmark_contest(short_name, contest_type, histories))
+    for size in args.sizes:
+        runs.append(
+            benchmark_contest(f"synthetic{size}", "algo", synthetic_histories(size))
+        )
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "runs": runs,
+    }
+    output = os.path.abspath(args.output)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
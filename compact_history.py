@@ -0,0 +1,158 @@
+import gzip
+import os
+
+from util import remove_written_file, write_bytes_if_changed, write_json_if_changed
+
+FORMAT_VERSION = 1
+# Số ký tự đầu của username (viết thường) dùng để chia shard
+PREFIX_LENGTH = 1
+
+
+def _encode_varint(value: int, out: bytearray) -> None:
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _decode_varint(buf: bytes, pos: int) -> tuple[int, int]:
+    value = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+# Zigzag để số âm cũng được mã hóa ngắn: 0, -1, 1, -2, ... -> 0, 1, 2, 3, ...
+def _zigzag(value: int) -> int:
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value: int) -> int:
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+
+def shard_key(username: str) -> str:
+    return username[:PREFIX_LENGTH].lower()
+
+
+# Mỗi user: varint độ dài username, username (utf-8), varint số contest,
+# perf mã hóa delta + zigzag varint, với heuristic thêm id của từng contest trong manifest
+# history giống 1 giá trị trong _rounded_perf_history.json (algo: perfs, heuristic: [perfs, contest short names])
+def _encode_history(
+    username: str,
+    history: list,
+    out: bytearray,
+    contest_ids: dict[str, int] | None = None,
+) -> None:
+    perfs = history if contest_ids is None else history[0]
+    name = username.encode()
+    _encode_varint(len(name), out)
+    out += name
+    _encode_varint(len(perfs), out)
+    previous = 0
+    for perf in perfs:
+        _encode_varint(_zigzag(perf - previous), out)
+        previous = perf
+    if contest_ids is not None:
+        for contest in history[1]:
+            # Contest mới gặp lần đầu được gán id tiếp theo
+            _encode_varint(contest_ids.setdefault(contest, len(contest_ids)), out)
+
+
+def decode_shard(buf: bytes, contests: list[str] | None = None) -> dict[str, list]:
+    histories: dict[str, list] = {}
+    pos = 0
+    while pos < len(buf):
+        length, pos = _decode_varint(buf, pos)
+        username = buf[pos : pos + length].decode()
+        pos += length
+        count, pos = _decode_varint(buf, pos)
+        perfs: list[int] = []
+        previous = 0
+        for _ in range(count):
+            delta, pos = _decode_varint(buf, pos)
+            previous += _unzigzag(delta)
+            perfs.append(previous)
+        if contests is None:
+            histories[username] = perfs
+        else:
+            names: list[str] = []
+            for _ in range(count):
+                contest_id, pos = _decode_varint(buf, pos)
+                names.append(contests[contest_id])
+            histories[username] = [perfs, names]
+    return histories
+
+
+class ShardedHistoryWriter:
+    """
+    Ghi lịch sử thi đấu của toàn bộ participant thành nhiều shard theo prefix của username
+    directory/manifest.json: danh sách shard (+ danh sách contest với heuristic)
+    directory/{prefix}.bin và directory/{prefix}.bin.gz: nội dung shard
+    Client chỉ cần tải manifest rồi tải shard chứa user cần tìm
+    Nhận từng user một, chỉ giữ lại bytes đã mã hóa của từng shard
+    """
+
+    def __init__(self, directory: str, contest_type: str):
+        self.directory = directory
+        self.contest_type = contest_type
+        self.contest_ids: dict[str, int] | None = (
+            {} if contest_type == "heuristic" else None
+        )
+        self.shards: dict[str, bytearray] = {}
+        self.users: dict[str, int] = {}
+
+    def add(self, username: str, history: list) -> None:
+        key = shard_key(username)
+        _encode_history(
+            username,
+            history,
+            self.shards.setdefault(key, bytearray()),
+            self.contest_ids,
+        )
+        self.users[key] = self.users.get(key, 0) + 1
+
+    # Return True nếu có file thay đổi
+    def close(self) -> bool:
+        os.makedirs(self.directory, exist_ok=True)
+        changed = False
+        manifest_shards: dict[str, dict] = {}
+        for key in sorted(self.shards):
+            payload = bytes(self.shards[key])
+            file = os.path.join(self.directory, f"{key}.bin")
+            if write_bytes_if_changed(file, payload) or not os.path.exists(
+                f"{file}.gz"
+            ):
+                # mtime=0 để file nén không đổi nếu nội dung không đổi
+                write_bytes_if_changed(f"{file}.gz", gzip.compress(payload, mtime=0))
+                changed = True
+            manifest_shards[key] = {"file": f"{key}.bin", "users": self.users[key]}
+
+        # Xóa shard không còn user nào
+        for file in os.listdir(self.directory):
+            if file.endswith((".bin", ".bin.gz")):
+                key = file.split(".")[0]
+                if key not in manifest_shards:
+                    remove_written_file(os.path.join(self.directory, file))
+                    changed = True
+
+        manifest = {
+            "version": FORMAT_VERSION,
+            "type": self.contest_type,
+            "prefix_length": PREFIX_LENGTH,
+            "shards": manifest_shards,
+        }
+        if self.contest_ids is not None:
+            manifest["contests"] = list(self.contest_ids)
+        changed = (
+            write_json_if_changed(
+                os.path.join(self.directory, "manifest.json"), manifest
+            )
+            or changed
+        )
+        return changed
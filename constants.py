@@ -15,6 +15,9 @@ PERF_BY_RANKING: dict[str, str] = {
 
 ALL_PARTICIPANTS_ROUNDED_PERF_HISTORY = "data/{}_rounded_perf_history.json"
 
+# Cùng nội dung với ALL_PARTICIPANTS_ROUNDED_PERF_HISTORY nhưng chia shard theo prefix của username
+ALL_PARTICIPANTS_ROUNDED_PERF_HISTORY_SHARDS = "data/{}_rounded_perf_history"
+
 # cần login
 STANDING_URL = "https://atcoder.jp/contests/{}/standings/json"
 
@@ -23,6 +26,42 @@ RESULT_URL = "https://atcoder.jp/contests/{}/results/json"
 
 CONTEST_TYPE_DUMP = "data/{}_contest_type.json"
 
+# username -> [rated rank, perf, rating hiện tại, rating mới] theo standings hiện tại
+RATING_PREDICTION = "data/{}_rating_prediction.json"
+
 HEURISTIC_CONTEST_LIST = "data/heuristic_contests.json"
 
-COMPETITION_HISTORY = "competition-history/{contest_type}/{username}.json"
\ No newline at end of file
+# Định dạng cũ: mỗi user 1 file json, chỉ còn dùng để migrate sang COMPETITION_HISTORY_DB
+COMPETITION_HISTORY = "competition-history/{contest_type}/{username}.json"
+
+COMPETITION_HISTORY_DB = "competition-history/history.db"
+
+# Danh sách user đã được cập nhật lịch sử thi đấu theo kết quả cuối cùng của contest
+# Dùng để chạy tiếp nếu bị dừng giữa chừng, bị xóa khi cập nhật xong
+FINAL_RESULT_CHECKPOINT = "competition-history/{}_final_result_checkpoint.json"
+
+# Danh sách username đã biết, mỗi dòng 1 user
+KNOWN_USERNAMES = "usernames.txt"
+
+# Bảng username -> (aperf, số contest đã thi) của từng contest_type
+APERF_TABLE = "competition-history/aperf_{}.npy"
+
+CONTESTS_URL = "https://atcoder.jp/contests/"
+
+# Kết quả parse CONTESTS_URL được dùng lại trong khoảng thời gian này (giây), đủ để các bước trong cùng 1 tick của scheduler dùng chung
+CONTESTS_PAGE_TTL = 30
+
+# Metric hiện tại theo định dạng text của Prometheus, được ghi lại sau mỗi tick
+METRICS_FILE = "metrics/acperf.prom"
+# Các lần ghi METRICS_FILE trước đó, được xoay vòng theo kích thước
+METRICS_HISTORY = "metrics/history.prom"
+
+# Cache response của fetch() theo url
+HTTP_CACHE = "http-cache/{}"
+
+# Thời gian (giây) dùng lại response đã cache mà không hỏi lại Atcoder, theo regex của url
+# Url ko khớp regex nào hoặc hết thời gian này thì gửi conditional GET (If-None-Match/If-Modified-Since)
+HTTP_CACHE_TTL: dict[str, int] = {
+    r"https://atcoder\.jp/contests/$": CONTESTS_PAGE_TTL,
+    r"https://atcoder\.jp/contests/archive\?": 24 * 60 * 60,
+}
\ No newline at end of file
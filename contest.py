@@ -1,23 +1,80 @@
 import json
-import math
 import os
+import re
+import threading
+import time
 from datetime import datetime, timedelta, timezone
-from functools import cache
-from typing import Literal
+from typing import Iterator, Literal
 
+import numpy as np
 from bs4 import BeautifulSoup
-from tqdm import tqdm
 
+from aperf import AperfState, AperfTable, next_decayed_average
+from compact_history import ShardedHistoryWriter
 from constants import (
     ALL_PARTICIPANTS_ROUNDED_PERF_HISTORY,
+    ALL_PARTICIPANTS_ROUNDED_PERF_HISTORY_SHARDS,
     CONTEST_TYPE_DUMP,
+    CONTESTS_PAGE_TTL,
+    CONTESTS_URL,
+    FINAL_RESULT_CHECKPOINT,
     HEURISTIC_CONTEST_LIST,
     PERF_BY_RANKING,
+    RATING_PREDICTION,
     RESULT_URL,
     STANDING_URL,
 )
 from fetch import fetch
-from util import commit_to_github
+from history import CompetitionHistory, HistoryColumns
+from history_store import history_store
+from metrics import metrics
+from performance import performance_by_rank, rounded_performance_by_rank
+from rating import HeuristicHistories, algo_ratings, jst_day, round_ratings
+from util import (
+    JsonObjectStreamWriter,
+    commit_to_github,
+    remove_written_file,
+    write_json_if_changed,
+)
+
+# Số user được cập nhật lịch sử thi đấu giữa 2 lần lưu checkpoint
+FINAL_RESULT_BATCH_SIZE = 1000
+
+
+class Standings:
+    """
+    Bảng xếp hạng của 1 contest tại 1 thời điểm
+    Fetch 1 lần trong mỗi lần chạy generate_performance_files rồi dùng chung cho mọi bước
+    """
+
+    participants: list[str]  # sorted
+    rated_participants: list[str]  # sorted
+    # Thứ hạng chỉ tính rated user, user đồng hạng có cùng thứ hạng
+    rated_ranks: dict[str, int]
+
+    def __init__(self, contest_type: Literal["algo", "heuristic"], data: dict):
+        rows = data.get("StandingsData")
+        self.participants = sorted([row.get("UserScreenName") for row in rows])
+        # In a heuristic contest, IsRated is always true, but a user who has not committed is considered as unrated user.
+        rated_rows = [
+            row
+            for row in rows
+            if row.get("IsRated")
+            and not (contest_type == "heuristic" and row["TotalResult"]["Count"] == 0)
+        ]
+        self.rated_participants = sorted(
+            [row.get("UserScreenName") for row in rated_rows]
+        )
+
+        self.rated_ranks = {}
+        previous_rank = None
+        # Dòng không có Rank giữ nguyên thứ tự trong standings và không đồng hạng với ai
+        for i, row in enumerate(sorted(rated_rows, key=lambda row: row.get("Rank", 0))):
+            rank = row.get("Rank")
+            if rank is None or rank != previous_rank:
+                rated_rank = i + 1
+            previous_rank = rank
+            self.rated_ranks[row.get("UserScreenName")] = rated_rank
 
 
 class Contest:
@@ -26,6 +83,8 @@ class Contest:
     long_name: str
     duration: int  # seconds
     link: str
+    # aperf state của từng contest (theo short_name), dùng chung giữa các lần chạy
+    _aperf_states: dict[str, AperfState] = {}
 
     def __init__(
         self, start_time: str, name: str, link: str, duration_str: str, rate_range: str
@@ -60,31 +119,27 @@ class Contest:
         return self.short_name == other.short_name
 
     def get_standings(self):
-        from fetch import getRequestedData, requestForFetch
+        from fetch import getRequestedData
 
         standingsUrl = STANDING_URL.format(self.short_name)
-        requestForFetch(standingsUrl)
         return getRequestedData(standingsUrl)
 
-    def get_participants(self, only_rated: bool = False) -> list[str]:
+    # Return None nếu fetch standings thất bại
+    @metrics.timed("standings")
+    def standings_snapshot(self) -> Standings | None:
         data = self.get_standings()
-        # In a heuristic contest, IsRated is always true, but a user who has not committed is considered as unrated user.
-        if self.type == "heuristic":
-            for user in data.get("StandingsData"):
-                if user["IsRated"] and user["TotalResult"]["Count"] == 0:
-                    user["IsRated"] = False
+        if data is None:
+            return None
+        return Standings(self.type, data)
 
+    def get_participants(
+        self, only_rated: bool = False, standings: Standings | None = None
+    ) -> list[str]:
+        if standings is None:
+            standings = self.standings_snapshot()
         if only_rated:
-            return sorted(
-                [
-                    user.get("UserScreenName")
-                    for user in data.get("StandingsData")
-                    if user.get("IsRated")
-                ]
-            )
-        return sorted(
-            [user.get("UserScreenName") for user in data.get("StandingsData")]
-        )
+            return standings.rated_participants
+        return standings.participants
 
     @property
     def is_rated(self) -> bool:
@@ -137,16 +192,23 @@ class Contest:
         return 4500
 
     def sync_competition_history_if_fixed_result_available(self):
-        from user import User
+        from user import competition_histories
 
         res = fetch(RESULT_URL.format(self.short_name), "json")
         if len(res) == 0:
             print("Fetch failed")
             return
-        for item in tqdm(res):
-            if item.get("IsRated"):
-                user = User(item.get("UserScreenName"))
-                user.competition_history(self.type, refresh=True)
+        histories = competition_histories(
+            [item.get("UserScreenName") for item in res if item.get("IsRated")],
+            self.type,
+            refresh=True,
+        )
+        AperfTable(self.type).upsert(
+            {
+                username: AperfTable.entry(history)
+                for username, history in histories.items()
+            }
+        )
 
     # def users(self):
     #     from user import User
@@ -162,45 +224,146 @@ class Contest:
     #     return S
 
     # Cập nhật lịch sử thi đấu của toàn bộ người dùng
+    # Chạy theo từng lô user, mỗi lô xong thì lưu checkpoint để lần chạy sau tiếp tục từ đó
+    @metrics.timed("final_result")
     def update_competition_history_if_fixed_result_available(self) -> bool:
-        from user import User
+        from user import fetch_competition_histories
 
         res = fetch(RESULT_URL.format(self.short_name), "json")
         if len(res) == 0:
             return False
 
-        print(f"Updating competition history of {self.short_name}")
-        for item in tqdm(res):
-            if item.get("IsRated"):
-                user = User(item.get("UserScreenName"))
-                user.removeIfHistoryObsolete(item["Competitions"] - 1, self.type)
-                competion_history = user.competition_history(self.type)
-                rounded_performance = item.get("Performance")
-                # Nếu người dùng có perf vượt quá mức giới hạn thì sẽ được làm tròn xuống
-                # Khi này phải fetch thẳng tới lịch sử thi đấu thì mới lấy được giá trị performance thực
-                if rounded_performance == self.max_perf:
-                    user.competition_history(self.type, refresh=True)
-                else:
-                    # performance nhỏ hơn perf max nên là inner và rounded như nhau
-                    inner_performance = rounded_performance
-                    contestShortName = item["ContestScreenName"].split(".")[0]
-                    existed = contestShortName in competion_history.get(
-                        "ContestShortName", []
-                    )
-                    if existed:
-                        continue
+        checkpoint = FINAL_RESULT_CHECKPOINT.format(self.short_name)
+        done: set[str] = set()
+        if os.path.exists(checkpoint):
+            with open(checkpoint, "r") as f:
+                done = set(json.load(f))
 
-                    competion_history["InnerPerformance"].append(inner_performance)
-                    competion_history["RoundedPerformance"].append(rounded_performance)
-                    endTime = datetime.fromisoformat(item.get("EndTime")).astimezone(
-                        timezone.utc
+        items = [
+            item
+            for item in res
+            if item.get("IsRated") and item.get("UserScreenName") not in done
+        ]
+        print(
+            f"Updating competition history of {self.short_name}: {len(items)} users left, {len(done)} done"
+        )
+        store = history_store()
+        failed: set[str] = set()
+        for i in range(0, len(items), FINAL_RESULT_BATCH_SIZE):
+            batch = items[i : i + FINAL_RESULT_BATCH_SIZE]
+            histories = store.load_many(
+                self.type, [item["UserScreenName"] for item in batch]
+            )
+            updated: list[tuple[str, CompetitionHistory, int | None]] = []
+            appended: dict[str, CompetitionHistory] = {}
+            refetch: list[str] = []
+            for item in batch:
+                username = item["UserScreenName"]
+                history = histories.get(username)
+                status = self._final_result_status(item, history)
+                if status == "present":
+                    updated.append((username, history, None))
+                elif status == "append":
+                    appended[username] = history
+                    updated.append(
+                        (username, history, self._append_final_result(item, history))
                     )
-                    competion_history["ContestEndTime"].append(endTime)
-                    competion_history["Weight"].append(self.weight)
-                    competion_history["ContestShortName"].append(contestShortName)
-                    user.save_performance_history(competion_history, self.type)
+                else:
+                    refetch.append(username)
+
+            # Thêm 1 contest vào cuối lịch sử: ghi 1 lần cho cả lô
+            store.upsert_many(self.type, appended)
+            # Lịch sử không khớp hoặc perf bị làm tròn: fetch lại song song
+            # User fetch lỗi không được đánh dấu xong, lần chạy sau sẽ fetch lại
+            fetched, errors = fetch_competition_histories(refetch, self.type)
+            failed.update(errors)
+            updated.extend(
+                (username, history, None) for username, history in fetched.items()
+            )
+            self._update_aperf_table(updated)
+
+            done.update(
+                item["UserScreenName"]
+                for item in batch
+                if item["UserScreenName"] not in errors
+            )
+            write_json_if_changed(checkpoint, sorted(done))
+            print(
+                f"{len(done)} users done: {len(appended)} appended, {len(refetch)} refetched"
+            )
+
+        if len(failed) > 0:
+            raise Exception(
+                f"ERROR: failed to fetch {len(failed)} histories after {self.short_name}, will retry from checkpoint"
+            )
+        if os.path.exists(checkpoint):
+            remove_written_file(checkpoint)
         return True
 
+    # Phân loại 1 dòng trong kết quả cuối cùng dựa vào lịch sử đang lưu của user
+    # present: lịch sử đã có contest này
+    # append: lịch sử đang thiếu đúng contest này, chỉ cần thêm vào cuối
+    # refetch: chưa có lịch sử, lịch sử không khớp số lần thi, hoặc perf bị làm tròn xuống max_perf
+    def _final_result_status(
+        self, item: dict, history: CompetitionHistory | None
+    ) -> Literal["present", "append", "refetch"]:
+        if history is None:
+            return "refetch"
+        count = len(history)
+        contestShortName = item["ContestScreenName"].split(".")[0]
+        if count == item["Competitions"] and history.has_contest(contestShortName):
+            return "present"
+        # Nếu người dùng có perf vượt quá mức giới hạn thì sẽ được làm tròn xuống
+        # Khi này phải fetch thẳng tới lịch sử thi đấu thì mới lấy được giá trị performance thực
+        if (
+            count != item["Competitions"] - 1
+            or item.get("Performance") == self.max_perf
+        ):
+            return "refetch"
+        return "append"
+
+    # Thêm contest vào cuối lịch sử thi đấu (không lưu lại)
+    # Return inner performance được thêm vào
+    def _append_final_result(self, item: dict, history: CompetitionHistory) -> int:
+        # performance nhỏ hơn perf max nên là inner và rounded như nhau
+        rounded_performance = item.get("Performance")
+        inner_performance = rounded_performance
+        endTime = datetime.fromisoformat(item.get("EndTime")).astimezone(timezone.utc)
+        history.append(
+            rounded_performance,
+            inner_performance,
+            endTime,
+            self.weight,
+            item["ContestScreenName"].split(".")[0],
+        )
+        return inner_performance
+
+    # Cập nhật bảng aperf sau khi lịch sử thi đấu thay đổi
+    # User chỉ có thêm 1 contest so với bảng thì dùng công thức truy hồi, còn lại tính lại từ lịch sử
+    def _update_aperf_table(
+        self, updated: list[tuple[str, CompetitionHistory, int | None]]
+    ) -> None:
+        table = AperfTable(self.type)
+        entries = table.lookup([username for username, _, _ in updated])
+        changed: dict[str, tuple[float, int]] = {}
+        for username, history, appended_perf in updated:
+            entry = entries.get(username)
+            count = len(history)
+            if entry is not None and entry[1] == count:
+                continue
+            if (
+                appended_perf is not None
+                and entry is not None
+                and entry[1] == count - 1
+            ):
+                changed[username] = (
+                    next_decayed_average(entry[0], entry[1], appended_perf),
+                    count,
+                )
+            else:
+                changed[username] = AperfTable.entry(history)
+        table.upsert(changed)
+
     # Dưới 1 ngày thì là short contest
     # Heuristic short contest có weight = 0.5, long có weight = 1
     def is_short_contest(self) -> bool:
@@ -226,118 +389,280 @@ class Contest:
         Some contests have a unusual name, such as "wtf19"
         So sometimes we can not determine the type of contests based on their names
         """
-        with open(CONTEST_TYPE_DUMP.format(self.short_name), "w") as f:
-            json.dump({"type": self.type}, f, indent=4)
-
-        commit_to_github(f"Create {CONTEST_TYPE_DUMP.format(self.short_name)}")
+        if write_json_if_changed(
+            CONTEST_TYPE_DUMP.format(self.short_name), {"type": self.type}, indent=4
+        ):
+            commit_to_github(f"Create {CONTEST_TYPE_DUMP.format(self.short_name)}")
 
     # Dựa vào lịch sử thi đấu của từng user -> performance trung bình
     # Return 1 mảng gồm performance của toàn bộ rated user
     # không quan tâm thứ tự, chỉ cần [aperf1, aperf2, ...]
-    def get_average_inner_performance_of_all_participants(self):
-        from user import User
-
-        standings = self.get_standings()
+    @metrics.timed("aperf")
+    def get_average_inner_performance_of_all_participants(
+        self, standings: Standings | None = None
+    ):
+        if standings is None:
+            standings = self.standings_snapshot()
         # In case, fetch the contest standings failed
         if standings is None:
             return []
 
-        participants: list[str] = self.get_participants(only_rated=True)
+        participants: list[str] = standings.rated_participants
         print(f"{len(participants)} rated users joined {self.short_name}")
+        # Chỉ tính aperf cho những user mới tham gia kể từ lần chạy trước
+        state = Contest._aperf_states.setdefault(self.short_name, AperfState())
+        return state.update(participants, self.average_inner_performances)
+
+    # Bỏ aperf state khi contest không còn job tạo dữ liệu dự đoán, tránh giữ lại mãi trong process
+    def drop_aperf_state(self) -> None:
+        Contest._aperf_states.pop(self.short_name, None)
+
+    # Lịch sử thi đấu của các user này vừa được ghi lại (warmer), aperf đang nhớ đã cũ
+    def forget_aperfs(self, usernames: list[str]) -> None:
+        state = Contest._aperf_states.get(self.short_name)
+        if state is not None:
+            state.forget(usernames)
+
+    # aperf của nhiều user cùng lúc, giống User.average_inner_performance
+    # Tra trong bảng aperf trước, user chưa có thì tính từ lịch sử thi đấu rồi thêm vào bảng
+    def average_inner_performances(self, usernames: list[str]) -> list[float]:
+        from user import competition_histories
+
+        table = AperfTable(self.type)
+        entries = table.lookup(usernames)
+        missing = [username for username in usernames if username not in entries]
+        if len(missing) > 0:
+            histories = competition_histories(missing, self.type)
+            missing_entries = {
+                username: AperfTable.entry(histories[username]) for username in missing
+            }
+            table.upsert(missing_entries)
+            entries.update(missing_entries)
+
         return [
-            User(username).average_inner_performance(self)
-            for username in tqdm(participants)
+            self.new_comer_aperf if entries[username][1] == 0 else entries[username][0]
+            for username in usernames
         ]
 
     # Dựa vào performance của toàn bộ participant, tính ra performance của người thứ 1, 2, ..., n trong contest
     # Từ performance ở contest này kết hợp với dữ liệu đã có thì tính ra rating
     # Hàm này giống nhau ở cả 2 loại contest
+    @metrics.timed("performance")
     def calculate_performance_in_contest(
-        self, average_innerperformance: list[float], save_to_file: bool = True
+        self,
+        average_innerperformance: list[float] | np.ndarray,
+        save_to_file: bool = True,
+        exact: bool = False,
     ):
         print(f"Calculating the performance in contest - {self.short_name}")
-        perf_in_contest: list[int] = []
-        n = len(average_innerperformance)
-
-        @cache
-        def perf2Rank(perf):
-            ans = 0
-            for aperf in average_innerperformance:
-                ans += 1 / (1 + pow(6.0, (perf - aperf) / 400.0))
-            ans += 0.5
-            return ans
-
-        # Rank of the top users will be rounded down to contest.max_perf
-        # So they have the same performance of contest.max_perf
-        top_rank = math.floor(perf2Rank(self.max_perf))
-        for _ in range(1, top_rank + 1):
-            perf_in_contest.append(self.max_perf)
-
-        # Calculate rating for the rest
-        cur_perf = self.max_perf
-        for rank in tqdm(range(top_rank + 1, n + 1)):
-            while perf2Rank(cur_perf) < rank:
-                cur_perf -= 1
-
-            diff1 = abs(perf2Rank(cur_perf) - rank)
-            diff2 = abs(perf2Rank(cur_perf + 1) - rank)
-            nearer_perf = cur_perf if (diff1 < diff2) else cur_perf + 1
-            perf_in_contest.append(nearer_perf)
+        # exact = True: giải phương trình expected rank = rank trên đường cong liên tục rồi làm tròn như Atcoder
+        # exact = False: chọn perf nguyên có expected rank gần rank nhất (cách tính cũ)
+        if exact:
+            perf_in_contest: list[int] = rounded_performance_by_rank(
+                average_innerperformance, self.max_perf
+            )
+        else:
+            perf_in_contest = performance_by_rank(
+                average_innerperformance, self.max_perf
+            )
 
         if save_to_file:
-            with open(PERF_BY_RANKING[self.type].format(self.short_name), "w") as f:
-                json.dump(perf_in_contest, f)
+            self.save_performance_in_contest(perf_in_contest)
 
         return perf_in_contest
 
+    # Return True nếu file thay đổi so với lần ghi trước
+    @metrics.timed("write_performance")
+    def save_performance_in_contest(self, perf_in_contest: list[int]) -> bool:
+        return write_json_if_changed(
+            PERF_BY_RANKING[self.type].format(self.short_name), perf_in_contest
+        )
+
+    # Rating hiện tại và rating sau contest của toàn bộ rated user theo thứ hạng hiện tại
+    # Client chỉ cần tải vài byte của mình thay vì perf theo thứ hạng + toàn bộ lịch sử thi đấu
+    # columns: lịch sử của rated user đã được gom trong lúc dump (dump_rounded_performance_history_of_all)
+    # Return {username: [rated rank, perf, rating hiện tại, rating mới]}
+    @metrics.timed("rating")
+    def predict_ratings(
+        self,
+        standings: Standings,
+        perf_in_contest: list[int],
+        columns: HistoryColumns | None = None,
+    ) -> dict[str, list[int]]:
+        usernames = standings.rated_participants
+        if len(usernames) == 0 or len(perf_in_contest) == 0:
+            return {}
+        if columns is None or len(columns) != len(usernames):
+            columns = HistoryColumns(self.type)
+            for _ in self._iter_histories(usernames, columns):
+                pass
+        ranks = [standings.rated_ranks[username] for username in usernames]
+        perfs = np.array(
+            [perf_in_contest[min(rank, len(perf_in_contest)) - 1] for rank in ranks]
+        )
+        if self.type == "algo":
+            old, new = algo_ratings(columns, perfs)
+        else:
+            old, new = HeuristicHistories(columns).ratings(
+                perfs, self.weight, jst_day(self.end_time)
+            )
+        return {
+            username: [rank, int(perf), int(old_rating), int(new_rating)]
+            for username, rank, perf, old_rating, new_rating in zip(
+                usernames, ranks, perfs, round_ratings(old), round_ratings(new)
+            )
+        }
+
+    # Return True nếu file thay đổi so với lần ghi trước
+    @metrics.timed("write_rating")
+    def save_rating_prediction(self, prediction: dict[str, list[int]]) -> bool:
+        return write_json_if_changed(
+            RATING_PREDICTION.format(self.short_name), prediction
+        )
+
     # Gói toàn bộ lịch sử thi đấu của user (ko kể rated hay unrated) rồi gửi về client
     # Do algo ko yêu cầu ngày tháng + weight nên algo và heuristic được xử lý khác nhau
-    def dump_rounded_performance_history_of_all(self) -> None:
+    # sharded = True: ghi thêm bản chia shard (xem compact_history.py) để client chỉ tải phần cần thiết
+    # Return True nếu file thay đổi so với lần ghi trước
+    # columns: nếu có, lịch sử của từng user được gom vào đây trong lúc ghi để dùng cho predict_ratings
+    @metrics.timed("write_history")
+    def dump_rounded_performance_history_of_all(
+        self,
+        standings: Standings | None = None,
+        sharded: bool = False,
+        columns: HistoryColumns | None = None,
+    ) -> bool:
         print(
             f"Creating {ALL_PARTICIPANTS_ROUNDED_PERF_HISTORY.format(self.short_name)} file"
         )
         if self.type == "algo":
-            self.dump_all_algo()
-        else:
-            self.dump_all_heuristic()
-
-    def dump_all_algo(self):
-        from user import User
+            return self.dump_all_algo(standings, sharded, columns)
+        return self.dump_all_heuristic(standings, sharded, columns)
+
+    # Load lịch sử thi đấu theo từng lô, đồng thời thêm vào columns (nếu có)
+    def _iter_histories(
+        self, participants: list[str], columns: HistoryColumns | None
+    ) -> Iterator[tuple[str, CompetitionHistory]]:
+        from user import iter_competition_histories
+
+        for participant, history in iter_competition_histories(participants, self.type):
+            if columns is not None:
+                columns.add(history)
+            yield participant, history
+
+    # Ghi lịch sử thi đấu ra file trong lúc duyệt từng user, không giữ toàn bộ trong bộ nhớ
+    def _write_rounded_performance_history(
+        self, items: Iterator[tuple[str, list]], sharded: bool
+    ) -> bool:
+        writers: list[JsonObjectStreamWriter | ShardedHistoryWriter] = [
+            JsonObjectStreamWriter(
+                ALL_PARTICIPANTS_ROUNDED_PERF_HISTORY.format(self.short_name)
+            )
+        ]
+        if sharded:
+            writers.append(
+                ShardedHistoryWriter(
+                    ALL_PARTICIPANTS_ROUNDED_PERF_HISTORY_SHARDS.format(
+                        self.short_name
+                    ),
+                    self.type,
+                )
+            )
+        for username, history in items:
+            for writer in writers:
+                writer.add(username, history)
+        return any([writer.close() for writer in writers])
+
+    def dump_all_algo(
+        self,
+        standings: Standings | None = None,
+        sharded: bool = False,
+        columns: HistoryColumns | None = None,
+    ) -> bool:
+        participants: list[str] = self.get_participants(True, standings)
+        print(f"Generating competition history of all participants {self.short_name}")
+        return self._write_rounded_performance_history(
+            (
+                (participant, history.rounded_performance.tolist())
+                for participant, history in self._iter_histories(participants, columns)
+            ),
+            sharded,
+        )
 
-        participants: list[str] = self.get_participants(only_rated=True)
-        data: dict[str, list[int]] = {}
+    def dump_all_heuristic(
+        self,
+        standings: Standings | None = None,
+        sharded: bool = False,
+        columns: HistoryColumns | None = None,
+    ) -> bool:
+        participants: list[str] = self.get_participants(True, standings)
         print(f"Generating competition history of all participants {self.short_name}")
-        for participant in tqdm(participants):
-            perfs = User(participant).competition_history(self.type)
-            data[participant] = perfs.get("RoundedPerformance")
+        return self._write_rounded_performance_history(
+            (
+                (
+                    participant,
+                    [
+                        history.rounded_performance.tolist(),
+                        history.contest_short_names(),
+                    ],
+                )
+                for participant, history in self._iter_histories(participants, columns)
+            ),
+            sharded,
+        )
 
-        with open(
-            ALL_PARTICIPANTS_ROUNDED_PERF_HISTORY.format(self.short_name), "w"
-        ) as f:
-            json.dump(data, f)
 
-    def dump_all_heuristic(self):
-        from user import User
+# Các tham số của Contest() lấy từ 1 dòng trong bảng contest của Atcoder
+def _contest_row(row) -> tuple[str, str, str, str, str]:
+    tds = row.find_all("td")
+    return (
+        tds[0].get_text(),
+        tds[1].get_text(),
+        tds[1].find("a").get("href"),
+        tds[2].get_text(),
+        tds[3].get_text().strip(),
+    )
 
-        participants: list[str] = self.get_participants(only_rated=True)
-        data: dict[str, list[int]] = {}
-        print(f"Generating competition history of all participants {self.short_name}")
-        for participant in tqdm(participants):
-            perfs = User(participant).competition_history(self.type)
-            data[participant] = [
-                perfs.get("RoundedPerformance"),
-                perfs.get("ContestShortName"),
-            ]
 
-        with open(
-            ALL_PARTICIPANTS_ROUNDED_PERF_HISTORY.format(self.short_name), "w"
-        ) as f:
-            json.dump(data, f)
+class ContestsPage:
+    """
+    Bảng Ongoing Contests và Upcoming Contests của trang CONTESTS_URL tại 1 thời điểm
+    Chỉ parse đoạn html từ tiêu đề tới hết bảng tương ứng thay vì parse cả trang
+    """
+
+    TITLES = ("Ongoing Contests", "Upcoming Contests")
+
+    def __init__(self, source: str):
+        self.parsed_at = time.monotonic()
+        self.rows: dict[str, list[tuple[str, str, str, str, str]]] = {
+            title: self._extract_rows(source, title) for title in self.TITLES
+        }
+
+    @staticmethod
+    def _extract_rows(source: str, title: str) -> list[tuple[str, str, str, str, str]]:
+        heading = re.search(rf"<h3[^>]*>\s*{re.escape(title)}\s*</h3>", source)
+        if heading is None:
+            return []
+        end = source.find("</table>", heading.end())
+        next_heading = source.find("<h3", heading.end())
+        # Không có bảng nào nằm dưới tiêu đề này
+        if end == -1 or (next_heading != -1 and next_heading < end):
+            return []
+
+        soup = BeautifulSoup(
+            source[heading.end() : end + len("</table>")], features="html.parser"
+        )
+        table = soup.find("table")
+        if table is None or table.find("tbody") is None:
+            return []
+        return [_contest_row(row) for row in table.find("tbody").find_all("tr")]
 
 
 class ContestManager:
     _contest_names: list[str] = []
     _resolved_upcoming_contest_names: list[str] = []
+    _contests_page: ContestsPage | None = None
+    _contests_page_lock = threading.Lock()
 
     def __init__(self):
         pass
@@ -366,42 +691,37 @@ class ContestManager:
                 new_cnts.append(active_contest)
                 self._contest_names.append(active_contest.short_name)
 
-        for contest in new_cnts:
-            # Hiện tại chỉ cần file chứa heuristic contest để lấy ra được thời gian
-            if contest.type == "heuristic":
-                self.add_contest_to_list(contest)
+        # Hiện tại chỉ cần file chứa heuristic contest để lấy ra được thời gian
+        heuristic_contests = [
+            contest for contest in new_cnts if contest.type == "heuristic"
+        ]
+        if len(heuristic_contests) > 0:
+            self.add_contests_to_list(heuristic_contests)
 
         if is_rated:
             new_cnts = list(filter(lambda contest: contest.is_rated, new_cnts))
 
         return new_cnts
 
+    # Trang contests chỉ được fetch và parse 1 lần trong CONTESTS_PAGE_TTL giây
+    # new_contests() và upcoming_contests() trong cùng 1 tick dùng chung kết quả
+    def contests_page(self) -> ContestsPage:
+        with ContestManager._contests_page_lock:
+            page = ContestManager._contests_page
+            if page is None or time.monotonic() - page.parsed_at >= CONTESTS_PAGE_TTL:
+                # fetch trả về bytes (res.content hoặc body đã cache), None nếu fetch thất bại
+                source = fetch(CONTESTS_URL, "text")
+                if source is None:
+                    return ContestsPage("")
+                page = ContestsPage(source.decode())
+                ContestManager._contests_page = page
+            return page
+
     def _get_contests(
         self, title: Literal["Ongoing Contests", "Upcoming Contests"]
     ) -> list[Contest]:
-        source = fetch("https://atcoder.jp/contests/", "text")
-        soup = BeautifulSoup(source, features="html.parser")
-        constests_h3 = soup.find("h3", string=title)
-
-        if constests_h3 is None:
-            return []
-
-        div = constests_h3.find_next_sibling("div")
-        upcoming_contest_table = div.find("table")
-        rows = upcoming_contest_table.find("tbody").find_all("tr")
-
-        contests: list[Contest] = []
-        for row in rows:
-            tds = row.find_all("td")
-            contest = Contest(
-                tds[0].get_text(),
-                tds[1].get_text(),
-                tds[1].find("a").get("href"),
-                tds[2].get_text(),
-                tds[3].get_text().strip(),
-            )
-            contests.append(contest)
-        return contests
+        # Mỗi lần gọi tạo Contest object mới, tránh dùng chung object giữa các job
+        return [Contest(*row) for row in self.contests_page().rows[title]]
 
     def _active_contests(self) -> list[Contest]:
         return self._get_contests("Ongoing Contests")
@@ -414,24 +734,24 @@ class ContestManager:
     # nhưng ở phần lịch sử thi đấu thì ko lấy ra được long/short
     # nên cần lưu lại thành 1 file rồi bất cứ khi nào muốn truy cập thì lấy từ đây ra
     def add_contest_to_list(self, contest: Contest) -> None:
-        contests = []
-        if os.path.exists(HEURISTIC_CONTEST_LIST):
-            with open(HEURISTIC_CONTEST_LIST, "r") as f:
-                contests = json.load(f)
-
-        contest_json = {
-            "type": contest.type,
-            "start_time": contest.start_time.strftime("%Y-%m-%d %H:%M:%S"),
-            "short_name": contest.short_name,
-            "duration": contest.duration,
-            "link": contest.link,
-            "is_short": contest.is_short_contest(),
-            "weight": contest.weight,
-        }
-        if contest_json not in contests:
-            contests.append(contest_json)
-
-        self.save_contest_list(contests)
+        self.add_contests_to_list([contest])
+
+    # Thêm nhiều contest cùng lúc, file chỉ được ghi lại 1 lần
+    def add_contests_to_list(self, contests: list[Contest]) -> None:
+        contest_catalog.add(
+            [
+                {
+                    "type": contest.type,
+                    "start_time": contest.start_time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "short_name": contest.short_name,
+                    "duration": contest.duration,
+                    "link": contest.link,
+                    "is_short": contest.is_short_contest(),
+                    "weight": contest.weight,
+                }
+                for contest in contests
+            ]
+        )
 
     # Lấy ra danh sách contest từ file dump
     # Lưu ý cái này lúc load ra đang để nguyên là json chứ ko convert ra contest object
@@ -441,12 +761,12 @@ class ContestManager:
         if not os.path.exists(HEURISTIC_CONTEST_LIST):
             self.fetch_all_heuristic_contest_list()
 
-        with open(HEURISTIC_CONTEST_LIST, "r") as f:
-            return json.load(f)
+        return contest_catalog.contests()
 
     # Generate danh sách contest bằng việc fetch html từ Atcoder rồi extract dữ liệu
     def fetch_all_heuristic_contest_list(self):
         NUMBER_OF_PAGES = 2  # tại thời điểm code thì có 2 page của heuristic contest
+        contests: list[Contest] = []
         for page in range(1, NUMBER_OF_PAGES + 1):
             source = fetch(
                 f"https://atcoder.jp/contests/archive?category=0&page={page}&ratedType=4",
@@ -456,23 +776,115 @@ class ContestManager:
             table = soup.find("table")
             rows = table.find("tbody").find_all("tr")
             for row in rows:
-                tds = row.find_all("td")
-                contest = Contest(
-                    tds[0].get_text(),
-                    tds[1].get_text(),
-                    tds[1].find("a").get("href"),
-                    tds[2].get_text(),
-                    tds[3].get_text().strip(),
-                )
-                self.add_contest_to_list(contest)
+                contests.append(Contest(*_contest_row(row)))
+        self.add_contests_to_list(contests)
 
     def save_contest_list(self, contests):
-        with open(HEURISTIC_CONTEST_LIST, "w") as f:
-            json.dump(contests, f, indent=4)
+        contest_catalog.save(contests)
 
     def find_contest(self, contest_name: str) -> dict | None:
-        contests = self.contest_list()
+        if not os.path.exists(HEURISTIC_CONTEST_LIST):
+            self.fetch_all_heuristic_contest_list()
+
+        contest = contest_catalog.find(contest_name)
+        if contest is None:
+            raise Exception(f"ERROR: contest {contest_name} not found")
+        return contest
+
+
+class ContestCatalog:
+    """
+    Danh sách contest trong HEURISTIC_CONTEST_LIST, load 1 lần rồi dùng chung cho toàn bộ process
+    Được đánh index theo short_name, tự load lại khi file bị thay đổi từ bên ngoài (theo mtime)
+    Đồng thời đổi short_name của mọi contest (algo lẫn heuristic) thành id nhỏ cho CompetitionHistory
+    id được gán theo thứ tự gặp lần đầu, chỉ có giá trị trong process hiện tại, không được ghi ra file
+    """
+
+    def __init__(self, file: str = HEURISTIC_CONTEST_LIST):
+        self.file = file
+        self.lock = threading.Lock()
+        self.mtime: float | None = None
+        self._contests: list[dict] = []
+        self._by_short_name: dict[str, dict] = {}
+        self._keys: set[str] = set()
+        self._contest_ids: dict[str, int] = {}
+        self._short_names: list[str] = []
+
+    @staticmethod
+    def _key(contest: dict) -> str:
+        return json.dumps(contest, sort_keys=True)
+
+    def _index(self, contests: list[dict]) -> None:
+        self._contests = contests
+        self._by_short_name = {}
         for contest in contests:
-            if contest["short_name"] == contest_name:
-                return contest
-        raise Exception(f"ERROR: contest {contest_name} not found")
+            self._by_short_name.setdefault(contest["short_name"], contest)
+        self._keys = {self._key(contest) for contest in contests}
+
+    # Gọi khi đang giữ lock
+    def _reload_if_changed(self) -> None:
+        mtime = os.path.getmtime(self.file) if os.path.exists(self.file) else None
+        if mtime == self.mtime:
+            return
+        contests = []
+        if mtime is not None:
+            with open(self.file, "r") as f:
+                contests = json.load(f)
+        self._index(contests)
+        self.mtime = mtime
+
+    # Gọi khi đang giữ lock
+    def _save(self, contests: list[dict]) -> None:
+        with open(self.file, "w") as f:
+            json.dump(contests, f, indent=4)
+        self._index(contests)
+        self.mtime = os.path.getmtime(self.file)
+
+    def contests(self) -> list[dict]:
+        with self.lock:
+            self._reload_if_changed()
+            return list(self._contests)
+
+    def find(self, short_name: str) -> dict | None:
+        with self.lock:
+            self._reload_if_changed()
+            return self._by_short_name.get(short_name)
+
+    def add(self, contests: list[dict]) -> None:
+        with self.lock:
+            self._reload_if_changed()
+            merged = list(self._contests)
+            keys = set(self._keys)
+            for contest in contests:
+                key = self._key(contest)
+                if key not in keys:
+                    keys.add(key)
+                    merged.append(contest)
+            # Không có contest mới thì không cần ghi lại file
+            if len(merged) > len(self._contests) or self.mtime is None:
+                self._save(merged)
+
+    def save(self, contests: list[dict]) -> None:
+        with self.lock:
+            self._save(contests)
+
+    def contest_ids(self, short_names: list[str]) -> list[int]:
+        # Đọc dict không cần lock, chỉ cần lock khi có contest mới
+        try:
+            return [self._contest_ids[short_name] for short_name in short_names]
+        except KeyError:
+            pass
+        with self.lock:
+            for short_name in short_names:
+                if short_name not in self._contest_ids:
+                    # Thêm tên trước để id đọc được (không lock) luôn có tên tương ứng
+                    self._short_names.append(short_name)
+                    self._contest_ids[short_name] = len(self._short_names) - 1
+            return [self._contest_ids[short_name] for short_name in short_names]
+
+    def short_names(self, contest_ids) -> list[str]:
+        short_names = self._short_names
+        return [short_names[contest_id] for contest_id in contest_ids]
+
+
+contest_catalog = ContestCatalog()
@@ -1,36 +1,154 @@
+import contextvars
+import hashlib
 import json
+import os
 import queue
+import re
 import sys
 import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from os import getenv
-from typing import Literal
+from typing import Callable, Literal, TypeVar
 
 import requests
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
 from seleniumbase import SB
+from tqdm import tqdm
+
+from constants import HTTP_CACHE, HTTP_CACHE_TTL
+from metrics import metrics
 
-session = requests.Session()
 load_dotenv()
 q = queue.Queue()
 
+# Số request tối đa mỗi giây gửi tới Atcoder (trước đây là sleep 0.7s trước mỗi request)
+FETCH_RATE = float(getenv("FETCH_RATE", 1 / 0.7))
+FETCH_BURST = int(getenv("FETCH_BURST", 1))
+FETCH_WORKERS = int(getenv("FETCH_WORKERS", 4))
+
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_maxsize=FETCH_WORKERS))
+
+
+class TokenBucket:
+    """
+    Giới hạn số request chung cho toàn bộ các thread
+    Token được nạp lại với tốc độ rate token/giây, tối đa capacity token
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens: float = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+rate_limiter = TokenBucket(FETCH_RATE, FETCH_BURST)
+
+
+def _cache_ttl(url: str) -> int:
+    for pattern, ttl in HTTP_CACHE_TTL.items():
+        if re.match(pattern, url):
+            return ttl
+    return 0
+
+
+# Response đã cache của url: meta (url, etag, last_modified, fetched_at) + body
+def _load_cached_response(url: str) -> tuple[dict, bytes] | None:
+    file = HTTP_CACHE.format(hashlib.sha1(url.encode()).hexdigest())
+    if not os.path.exists(f"{file}.json") or not os.path.exists(f"{file}.body"):
+        return None
+    with open(f"{file}.json", "r") as f:
+        meta = json.load(f)
+    with open(f"{file}.body", "rb") as f:
+        return meta, f.read()
+
+
+def _save_cached_response(url: str, meta: dict, body: bytes | None = None) -> None:
+    file = HTTP_CACHE.format(hashlib.sha1(url.encode()).hexdigest())
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    # Ghi ra file tạm rồi rename để thread khác ko đọc phải file ghi dở
+    tmp = f"{threading.get_ident()}.tmp"
+    if body is not None:
+        with open(f"{file}.body.{tmp}", "wb") as f:
+            f.write(body)
+        os.replace(f"{file}.body.{tmp}", f"{file}.body")
+    with open(f"{file}.json.{tmp}", "w") as f:
+        json.dump(meta, f)
+    os.replace(f"{file}.json.{tmp}", f"{file}.json")
+
 
 # Hàm fetch này sử dụng request để fetch
 # Sử dụng cho các url ko cần xác minh captcha
 # Với url cần xác minh captcha, sử dụng hàm bên dưới
+# Response được cache theo url: còn trong HTTP_CACHE_TTL thì dùng luôn,
+# hết hạn thì gửi conditional GET, Atcoder trả về 304 thì dùng lại body đã cache
 def fetch(
     url: str,
     output_format: Literal["json", "text"] = "json",
     retry: int = 10,
     sleep_time_after_failing: int = 2,  # seconds
 ) -> dict | str:
-    time.sleep(0.7)
+    def parse(body: bytes) -> dict | str:
+        return json.loads(body) if output_format == "json" else body
+
+    ttl = _cache_ttl(url)
+    cached = _load_cached_response(url)
+    headers = {"User-Agent": "Mozilla/5.0"}
+    if cached is not None:
+        meta, body = cached
+        if time.time() - meta["fetched_at"] < ttl:
+            metrics.inc("acperf_fetch_cache_total", result="hit")
+            return parse(body)
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
     retry_count: int = 0
     while retry_count < retry:
         try:
-            res = session.get(url, headers={"User-Agent": "Mozilla/5.0"})
+            rate_limiter.acquire()
+            metrics.inc("acperf_fetch_requests_total", source="requests")
+            res = session.get(url, headers=headers)
+            if res.status_code == 304 and cached is not None:
+                metrics.inc("acperf_fetch_cache_total", result="revalidated")
+                meta["fetched_at"] = time.time()
+                _save_cached_response(url, meta)
+                return parse(body)
             if res.status_code == 200:
+                metrics.inc("acperf_fetch_cache_total", result="miss")
+                etag = res.headers.get("ETag")
+                last_modified = res.headers.get("Last-Modified")
+                if ttl > 0 or etag or last_modified:
+                    _save_cached_response(
+                        url,
+                        {
+                            "url": url,
+                            "etag": etag,
+                            "last_modified": last_modified,
+                            "fetched_at": time.time(),
+                        },
+                        res.content,
+                    )
                 return res.json() if output_format == "json" else res.content
             else:
                 raise Exception(
@@ -39,62 +157,152 @@ def fetch(
         except Exception as e:
             retry_count += 1
             print(f"fetch() raise an exception '{e}'. Retries {retry_count} times")
-            time.sleep(sleep_time_after_failing * int(pow(2, retry_count)))
+            sleep_time = sleep_time_after_failing * int(pow(2, retry_count))
+            metrics.inc("acperf_fetch_retries_total", source="requests")
+            metrics.inc("acperf_fetch_retry_sleep_seconds_total", sleep_time)
+            time.sleep(sleep_time)
+
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+# Chạy func cho từng item bằng FETCH_WORKERS thread, dùng cho các hàm có gọi fetch()
+# Các thread dùng chung rate_limiter nên tổng số request vẫn nằm trong giới hạn
+def fetch_concurrently(func: Callable[[T], R], items: list[T]) -> list[R]:
+    # Các thread của pool chạy với context của thread gọi (contest hiện tại của metrics)
+    context = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        return list(
+            tqdm(
+                executor.map(lambda item: context.copy().run(func, item), items),
+                total=len(items),
+            )
+        )
+
+
+# Giống fetch_concurrently nhưng lỗi của 1 item không làm mất kết quả của các item còn lại
+# @return (kết quả của các item thành công, lỗi của các item thất bại), key là item
+def fetch_each_concurrently(
+    func: Callable[[T], R], items: list[T]
+) -> tuple[dict[T, R], dict[T, Exception]]:
+    def run(item: T) -> tuple[R | None, Exception | None]:
+        try:
+            return func(item), None
+        except Exception as e:
+            return None, e
+
+    results: dict[T, R] = {}
+    errors: dict[T, Exception] = {}
+    for item, (result, error) in zip(items, fetch_concurrently(run, items)):
+        if error is None:
+            results[item] = result
+        else:
+            errors[item] = error
+    return results, errors
 
 
 fetchedData = dict()  # fetchedData['url'] = {'data': ..., 'timestamp': ...}
+# Các url đang chờ browser fetch, request trùng url sẽ dùng chung 1 Future
+pendingRequests: dict[str, Future] = dict()
+pendingRequestsLock = threading.Lock()
+
+# Số browser (mỗi browser 1 tab, login riêng) cùng xử lý hàng đợi
+FETCH_BROWSER_WORKERS = int(getenv("FETCH_BROWSER_WORKERS", 1))
+
 
+def requestForFetch(url: str) -> Future:
+    with pendingRequestsLock:
+        if url in pendingRequests:
+            return pendingRequests[url]
+        future = Future()
+        pendingRequests[url] = future
+        q.put(url)
+        return future
 
-def requestForFetch(url: str):
-    q.put(url)
 
+def _resolveRequest(url: str, data: dict | None = None, error: Exception | None = None):
+    with pendingRequestsLock:
+        future = pendingRequests.pop(url, None)
+    if data is not None:
+        # Store to cache
+        fetchedData[url] = {"data": data, "timestamp": time.time()}
+    if future is None:
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(data)
 
-def getRequestedData(url: str):
-    cnt: int = 0
-    while cnt < 10:
-        if (
-            fetchedData.get(url)
-            and time.time() - fetchedData[url]["timestamp"] < 5 * 60
-        ):
-            return fetchedData[url]["data"]
-        time.sleep(5)
-        cnt += 1
+
+# Chờ kết quả fetch của url, nếu fetch thất bại thì dùng dữ liệu cũ trong vòng 5 phút
+def getRequestedData(url: str, timeout: int = 50):
+    metrics.inc("acperf_fetch_requests_total", source="browser")
+    try:
+        return requestForFetch(url).result(timeout=timeout)
+    except Exception as e:
+        print(f"getRequestedData() raise an exception '{e}'")
+        metrics.inc("acperf_fetch_retries_total", source="browser")
+    if fetchedData.get(url) and time.time() - fetchedData[url]["timestamp"] < 5 * 60:
+        metrics.inc("acperf_fetch_cache_total", result="stale")
+        return fetchedData[url]["data"]
     return None
 
 
+def _login(sb, retry: int) -> bool:
+    for _ in range(retry):
+        sb.activate_cdp_mode("https://atcoder.jp/login")
+        sb.sleep(10)
+        sb.uc_gui_click_captcha(retry=True)
+        sb.sleep(2)
+        sb.cdp.type("#username", getenv("ATCODER_USER_NAME"))
+        sb.cdp.type("#password", getenv("ATCODER_PASSWORD"))
+        sb.cdp.click("button[id=submit]")
+        sb.sleep(5)
+        page_title = sb.get_page_title()
+        print(page_title)
+        if page_title.startswith("AtCoder"):
+            print(f"Login OK ({_}/{retry}) :3")
+            return True
+        print(f"Login failed ({_}/{retry}) :(")
+    return False
+
+
+# Mở url json rồi lấy nội dung trong thẻ <pre>, return None nếu ko có (session hết hạn)
+def _openJson(sb, url: str) -> dict | None:
+    sb.cdp.open(url)
+    page_source = sb.cdp.get_page_source()
+    soup = BeautifulSoup(page_source, "html.parser")
+    pre_tag = soup.find("pre")
+    if pre_tag is None:
+        return None
+    return json.loads(pre_tag.text)
+
+
 def fetchWithBrowser(retry: int = 15):
     with SB(binary_location="/var/lib/flatpak/app/com.google.Chrome/current/active/files/extra/google-chrome", uc=True, locale="en") as sb:
-        for _ in range(retry):
-            sb.activate_cdp_mode("https://atcoder.jp/login")
-            sb.sleep(10)
-            sb.uc_gui_click_captcha(retry=True)
-            sb.sleep(2)
-            sb.cdp.type("#username", getenv("ATCODER_USER_NAME"))
-            sb.cdp.type("#password", getenv("ATCODER_PASSWORD"))
-            sb.cdp.click("button[id=submit]")
-            sb.sleep(5)
-            page_title = sb.get_page_title()
-            print(page_title)
-            if page_title.startswith("AtCoder"):
-                print(f"Login OK ({_}/{retry}) :3")
-                break
-            else:
-                print(f"Login failed ({_}/{retry}) :(")
-                if _ == retry - 1:
-                    sys.exit("Login failed!!!")
+        if not _login(sb, retry):
+            sys.exit("Login failed!!!")
 
         while True:
             requestedUrl = q.get()
-            sb.cdp.open(requestedUrl)
-            page_source = sb.cdp.get_page_source()
-            soup = BeautifulSoup(page_source, "html.parser")
-            pre_tag = soup.find("pre")
-            if pre_tag is None:
-                return  # fetch fails
-            data = json.loads(pre_tag.text)
-            # Store to cache
-            fetchedData[requestedUrl] = {"data": data, "timestamp": time.time()}
-
-
-#fetchWithBrowserThread = threading.Thread(target=fetchWithBrowser)
-#fetchWithBrowserThread.start()
+            try:
+                data = _openJson(sb, requestedUrl)
+                if data is None:
+                    # Session hết hạn thì login lại rồi fetch thêm 1 lần
+                    print("Session expired, login again")
+                    if _login(sb, retry):
+                        data = _openJson(sb, requestedUrl)
+                if data is None:
+                    raise Exception(f"Fetch {requestedUrl} with browser failed")
+                _resolveRequest(requestedUrl, data)
+            except Exception as e:
+                _resolveRequest(requestedUrl, error=e)
+
+
+def startFetchWithBrowserThreads(workers: int = FETCH_BROWSER_WORKERS):
+    for _ in range(workers):
+        threading.Thread(target=fetchWithBrowser, daemon=True).start()
+
+
+#startFetchWithBrowserThreads()
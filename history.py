@@ -0,0 +1,166 @@
+from array import array
+from datetime import datetime, timezone
+from functools import cache
+
+END_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+# "2025-01-19 10:00:00" (UTC) -> unix time
+# Lịch sử cũ có thể có phần timezone (+00:00) do datetime được ghi thẳng ra json, thời gian luôn là UTC
+# Nhiều user có chung thời gian kết thúc contest nên kết quả được cache lại
+@cache
+def _parse_end_time(end_time: str) -> int:
+    return int(
+        datetime.fromisoformat(end_time[:19]).replace(tzinfo=timezone.utc).timestamp()
+    )
+
+
+@cache
+def _format_end_time(end_time: int) -> str:
+    return datetime.fromtimestamp(end_time, timezone.utc).strftime(END_TIME_FORMAT)
+
+
+def epoch(end_time: str | datetime | int) -> int:
+    if isinstance(end_time, str):
+        return _parse_end_time(end_time)
+    if isinstance(end_time, datetime):
+        return int(end_time.timestamp())
+    return int(end_time)
+
+
+class CompetitionHistory:
+    """
+    Lịch sử thi đấu của 1 user (1 contest_type), lưu dạng cột thay vì dict gồm 5 list Python
+    Thời gian kết thúc là unix time, tên contest được đổi thành id nhỏ qua contest_catalog (chỉ có giá trị trong process hiện tại)
+    to_dict() trả về đúng định dạng json đang lưu trong history_store:
+    {
+        'RoundedPerformance': [100, 2400, ...],
+        'InnerPerformance': [100, 3000, ...],
+        'ContestEndTime': ['2025-01-19 10:00:00', ...],
+        'Weight': [0.5 | 1, 0.5 | 1, ...],
+        'ContestShortName': ['abc123', 'agc012', ...]
+    }
+    """
+
+    __slots__ = (
+        "rounded_performance",
+        "inner_performance",
+        "end_times",
+        "weights",
+        "contest_ids",
+    )
+
+    def __init__(self):
+        self.rounded_performance = array("i")
+        self.inner_performance = array("i")
+        self.end_times = array("q")
+        # weight chỉ là 0.5 hoặc 1 nên float32 là đủ
+        self.weights = array("f")
+        self.contest_ids = array("I")
+
+    def __len__(self) -> int:
+        return len(self.inner_performance)
+
+    def __repr__(self) -> str:
+        return f"CompetitionHistory({self.to_dict()})"
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, CompetitionHistory):
+            return NotImplemented
+        return all(
+            getattr(self, column) == getattr(other, column) for column in self.__slots__
+        )
+
+    @classmethod
+    def from_dict(cls, history: dict) -> "CompetitionHistory":
+        from contest import contest_catalog
+
+        result = cls()
+        result.rounded_performance.extend(history["RoundedPerformance"])
+        result.inner_performance.extend(history["InnerPerformance"])
+        result.end_times.extend(
+            epoch(end_time) for end_time in history["ContestEndTime"]
+        )
+        result.weights.extend(history["Weight"])
+        result.contest_ids.extend(
+            contest_catalog.contest_ids(history["ContestShortName"])
+        )
+        return result
+
+    def to_dict(self) -> dict:
+        return {
+            "RoundedPerformance": self.rounded_performance.tolist(),
+            "InnerPerformance": self.inner_performance.tolist(),
+            "ContestEndTime": [
+                _format_end_time(end_time) for end_time in self.end_times
+            ],
+            "Weight": [
+                int(weight) if weight.is_integer() else weight
+                for weight in self.weights.tolist()
+            ],
+            "ContestShortName": self.contest_short_names(),
+        }
+
+    def contest_short_names(self) -> list[str]:
+        from contest import contest_catalog
+
+        return contest_catalog.short_names(self.contest_ids)
+
+    def has_contest(self, short_name: str) -> bool:
+        from contest import contest_catalog
+
+        return contest_catalog.contest_ids([short_name])[0] in self.contest_ids
+
+    def append(
+        self,
+        rounded_performance: int,
+        inner_performance: int,
+        end_time: str | datetime | int,
+        weight: float,
+        short_name: str,
+    ) -> None:
+        from contest import contest_catalog
+
+        self.rounded_performance.append(rounded_performance)
+        self.inner_performance.append(inner_performance)
+        self.end_times.append(epoch(end_time))
+        self.weights.append(weight)
+        self.contest_ids.extend(contest_catalog.contest_ids([short_name]))
+
+
+class HistoryColumns:
+    """
+    Lịch sử thi đấu của nhiều user nối liền nhau theo từng cột, user thứ i có counts[i] contest
+    Được thêm vào từng user trong lúc duyệt iter_competition_histories (cùng lúc với ghi file lịch sử)
+    nên không cần giữ CompetitionHistory của toàn bộ user trong bộ nhớ
+    Chỉ giữ những cột dùng để tính rating: algo cần RoundedPerformance, heuristic cần inner perf, ngày kết thúc, weight
+    """
+
+    __slots__ = (
+        "contest_type",
+        "counts",
+        "rounded_performance",
+        "inner_performance",
+        "end_times",
+        "weights",
+    )
+
+    def __init__(self, contest_type: str):
+        self.contest_type = contest_type
+        self.counts = array("q")
+        self.rounded_performance = array("i")
+        self.inner_performance = array("i")
+        self.end_times = array("q")
+        self.weights = array("f")
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def add(self, history: CompetitionHistory) -> None:
+        self.counts.append(len(history))
+        if self.contest_type == "algo":
+            self.rounded_performance.extend(history.rounded_performance)
+        else:
+            self.inner_performance.extend(history.inner_performance)
+            self.end_times.extend(history.end_times)
+            self.weights.extend(history.weights)
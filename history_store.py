@@ -0,0 +1,170 @@
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import cache
+from typing import Literal
+
+from tqdm import tqdm
+
+from constants import COMPETITION_HISTORY, COMPETITION_HISTORY_DB
+from history import CompetitionHistory
+
+# SQLite giới hạn số tham số trong 1 câu query
+_MAX_QUERY_PARAMS = 900
+
+
+class HistoryStore:
+    """
+    Lưu lịch sử thi đấu của toàn bộ user trong 1 file SQLite thay vì mỗi user 1 file json
+    Mỗi dòng là lịch sử của 1 user với 1 contest_type, lưu dạng json (CompetitionHistory.to_dict)
+    Khi load được đổi thành CompetitionHistory
+    """
+
+    def __init__(self, path: str = COMPETITION_HISTORY_DB):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS competition_history (
+                contest_type TEXT NOT NULL,
+                username TEXT NOT NULL,
+                history TEXT NOT NULL,
+                updated_at REAL,
+                PRIMARY KEY (contest_type, username)
+            )
+            """)
+        # Store tạo trước khi có cột updated_at: dòng cũ có updated_at = NULL
+        columns = [
+            row[1]
+            for row in self.conn.execute("PRAGMA table_info(competition_history)")
+        ]
+        if "updated_at" not in columns:
+            self.conn.execute(
+                "ALTER TABLE competition_history ADD COLUMN updated_at REAL"
+            )
+        self.conn.commit()
+
+    def load(
+        self, contest_type: Literal["algo", "heuristic"], username: str
+    ) -> CompetitionHistory | None:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT history FROM competition_history WHERE contest_type = ? AND username = ?",
+                (contest_type, username),
+            ).fetchone()
+        return None if row is None else CompetitionHistory.from_dict(json.loads(row[0]))
+
+    # User chưa có trong store sẽ không có trong kết quả trả về
+    def load_many(
+        self, contest_type: Literal["algo", "heuristic"], usernames: list[str]
+    ) -> dict[str, CompetitionHistory]:
+        result: dict[str, CompetitionHistory] = {}
+        for i in range(0, len(usernames), _MAX_QUERY_PARAMS):
+            chunk = usernames[i : i + _MAX_QUERY_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT username, history FROM competition_history WHERE contest_type = ? AND username IN ({placeholders})",
+                    (contest_type, *chunk),
+                ).fetchall()
+            for username, history in rows:
+                result[username] = CompetitionHistory.from_dict(json.loads(history))
+        return result
+
+    # Thời điểm (unix time) lịch sử của từng user được ghi lần cuối
+    # User chưa có trong store sẽ không có trong kết quả, dòng được ghi trước khi có cột updated_at có giá trị None
+    def updated_at_many(
+        self, contest_type: Literal["algo", "heuristic"], usernames: list[str]
+    ) -> dict[str, float | None]:
+        result: dict[str, float | None] = {}
+        for i in range(0, len(usernames), _MAX_QUERY_PARAMS):
+            chunk = usernames[i : i + _MAX_QUERY_PARAMS]
+            placeholders = ",".join("?" * len(chunk))
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT username, updated_at FROM competition_history WHERE contest_type = ? AND username IN ({placeholders})",
+                    (contest_type, *chunk),
+                ).fetchall()
+            result.update(rows)
+        return result
+
+    def load_all(
+        self, contest_type: Literal["algo", "heuristic"]
+    ) -> dict[str, CompetitionHistory]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT username, history FROM competition_history WHERE contest_type = ?",
+                (contest_type,),
+            ).fetchall()
+        return {
+            username: CompetitionHistory.from_dict(json.loads(history))
+            for username, history in rows
+        }
+
+    def upsert(
+        self,
+        contest_type: Literal["algo", "heuristic"],
+        username: str,
+        history: CompetitionHistory,
+    ) -> None:
+        self.upsert_many(contest_type, {username: history})
+
+    def upsert_many(
+        self,
+        contest_type: Literal["algo", "heuristic"],
+        histories: dict[str, CompetitionHistory],
+    ) -> None:
+        updated_at = time.time()
+        rows = [
+            (contest_type, username, json.dumps(history.to_dict()), updated_at)
+            for username, history in histories.items()
+        ]
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO competition_history (contest_type, username, history, updated_at) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.commit()
+
+    def delete(self, contest_type: Literal["algo", "heuristic"], username: str) -> None:
+        with self.lock:
+            self.conn.execute(
+                "DELETE FROM competition_history WHERE contest_type = ? AND username = ?",
+                (contest_type, username),
+            )
+            self.conn.commit()
+
+    def migrate_from_json_tree(self) -> None:
+        """
+        Chuyển toàn bộ file competition-history/{contest_type}/{username}.json vào store
+        Chỉ cần chạy 1 lần: python history_store.py
+        """
+        for contest_type in ["algo", "heuristic"]:
+            files = glob.glob(
+                COMPETITION_HISTORY.format(contest_type=contest_type, username="*")
+            )
+            print(f"Migrating {len(files)} {contest_type} history files")
+            histories: dict[str, CompetitionHistory] = {}
+            for file in tqdm(files):
+                username = os.path.splitext(os.path.basename(file))[0]
+                with open(file, "r") as f:
+                    histories[username] = CompetitionHistory.from_dict(json.load(f))
+                if len(histories) >= 10000:
+                    self.upsert_many(contest_type, histories)
+                    histories = {}
+            self.upsert_many(contest_type, histories)
+
+
+# Dùng chung 1 store cho toàn bộ User
+@cache
+def history_store() -> HistoryStore:
+    return HistoryStore()
+
+
+if __name__ == "__main__":
+    history_store().migrate_from_json_tree()
@@ -0,0 +1,129 @@
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from typing import Callable
+
+import schedule
+from dotenv import load_dotenv
+
+from metrics import metrics
+
+load_dotenv()
+
+JOB_WORKERS = int(getenv("JOB_WORKERS", 4))
+
+
+class JobStats:
+    count: int = 0
+    skipped: int = 0
+    overran: int = 0
+    last_duration: float = 0  # seconds
+    max_duration: float = 0  # seconds
+
+    def __str__(self) -> str:
+        return f"runs={self.count} skipped={self.skipped} overran={self.overran} last={self.last_duration:.1f}s max={self.max_duration:.1f}s"
+
+
+class JobExecutor:
+    """
+    Chạy các job của schedule trên 1 thread pool thay vì chạy tuần tự trong schedule.run_pending()
+    Các job cùng key (cùng contest) không bao giờ chạy chồng lên nhau:
+    nếu lần chạy trước chưa xong thì lần này bị bỏ qua
+    """
+
+    def __init__(self, max_workers: int = JOB_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.running: set[str] = set()
+        self.stats: dict[str, JobStats] = {}
+        # Job trả về schedule.CancelJob khi chạy trong thread, được hủy ở thread chính
+        self.jobs_to_cancel: list[schedule.Job] = []
+        # Job được tạo trong thread (job lấy danh sách contest) cũng được thêm vào schedule ở thread chính
+        self.jobs_to_add: list[tuple[schedule.Job, Callable]] = []
+
+    def every(self, job: schedule.Job, key: str, func: Callable, **kwargs):
+        """
+        Thay cho job.do(func, **kwargs)
+        key: các job cùng key không chạy đồng thời, thường là contest.short_name
+        """
+
+        def submit():
+            self.submit(key, func, job, **kwargs)
+
+        if threading.current_thread() is threading.main_thread():
+            return job.do(submit)
+        with self.lock:
+            self.jobs_to_add.append((job, submit))
+        return job
+
+    def submit(
+        self, key: str, func: Callable, job: schedule.Job | None = None, **kwargs
+    ) -> bool:
+        name = f"{func.__name__}({key})"
+        with self.lock:
+            stats = self.stats.setdefault(name, JobStats())
+            if key in self.running:
+                stats.skipped += 1
+                print(f"Skip {name} because the previous job of {key} is still running")
+                return False
+            self.running.add(key)
+        self.pool.submit(self._run, key, name, func, job, kwargs)
+        return True
+
+    def _run(
+        self,
+        key: str,
+        name: str,
+        func: Callable,
+        job: schedule.Job | None,
+        kwargs: dict,
+    ) -> None:
+        start = time.monotonic()
+        # Metric của job được gắn label theo contest của job (job warm dùng chung key cho nhiều contest)
+        contest = kwargs.get("contest")
+        try:
+            with metrics.tick(
+                key if contest is None else contest.short_name, func.__name__
+            ):
+                result = func(**kwargs)
+            if result is schedule.CancelJob and job is not None:
+                with self.lock:
+                    self.jobs_to_cancel.append(job)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            duration = time.monotonic() - start
+            with self.lock:
+                self.running.discard(key)
+                stats = self.stats[name]
+                stats.count += 1
+                stats.last_duration = duration
+                stats.max_duration = max(stats.max_duration, duration)
+                if (
+                    job is not None
+                    and job.period
+                    and duration > job.period.total_seconds()
+                ):
+                    stats.overran += 1
+                    print(
+                        f"{name} took {duration:.1f}s, longer than its interval {job.period}"
+                    )
+
+    def run_pending(self) -> None:
+        with self.lock:
+            jobs_to_cancel, self.jobs_to_cancel = self.jobs_to_cancel, []
+            jobs_to_add, self.jobs_to_add = self.jobs_to_add, []
+        for job in jobs_to_cancel:
+            schedule.cancel_job(job)
+        for job, submit in jobs_to_add:
+            job.do(submit)
+        schedule.run_pending()
+
+    def latency_report(self) -> str:
+        with self.lock:
+            return "\n".join(f"{name}: {stats}" for name, stats in self.stats.items())
+
+
+executor = JobExecutor()
@@ -1,10 +1,23 @@
 import time
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
+from os import getenv
 
 import schedule
 
 from contest import Contest, ContestManager
+from jobs import executor
+from pipeline import prediction_pool
+from server import prediction_store, start_server
 from util import commit_to_github
+from warmer import warm_competition_histories
+
+# Ghi thêm lịch sử thi đấu dạng chia shard bên cạnh file json
+SHARDED_HISTORY = getenv("SHARDED_HISTORY") == "1"
+# Tính perf theo thứ hạng bằng cách giải phương trình expected rank rồi làm tròn như Atcoder
+# thay vì chọn perf nguyên gần nhất (lệch vài điểm so với perf thật)
+EXACT_PERF = getenv("EXACT_PERF") == "1"
+# Port của service trả về dữ liệu dự đoán, không đặt thì không chạy service
+SERVE_PORT = getenv("SERVE_PORT")
 
 
 # Tạo danh sách các job dựa vào contest hiện tại
@@ -17,27 +30,41 @@ def create_jobs_from_contests_list():
     for contest in active_contests:
         contest.dump_contest_type()
         # Update the participants's performance after the contest has finished
-        schedule.every(3).hours.do(
-            update_users_perf_based_on_final_result, contest=contest
+        executor.every(
+            schedule.every(3).hours,
+            contest.short_name,
+            update_users_perf_based_on_final_result,
+            contest=contest,
         )
-        generate_performance_files(contest)  # run intermediately
+        # run intermediately
+        executor.submit(contest.short_name, generate_performance_files, contest=contest)
 
         if contest.type == "heuristic":
             # Update aperf every 5 minutes
             interval_in_minutes = 2 if contest.is_short_contest() else 10
-            schedule.every(interval_in_minutes).minutes.until(
-                timedelta(
-                    seconds=contest.duration
-                )  # contest.start_time + timedelta(seconds=contest.duration)
-            ).do(generate_performance_files, contest=contest)
+            executor.every(
+                schedule.every(interval_in_minutes).minutes.until(
+                    timedelta(
+                        seconds=contest.duration
+                    )  # contest.start_time + timedelta(seconds=contest.duration)
+                ),
+                contest.short_name,
+                generate_performance_files,
+                contest=contest,
+            )
 
         elif contest.type == "algo":
             # Update aperf every n minutes until the contest ends from now.
-            schedule.every(2).minutes.until(
-                timedelta(
-                    seconds=contest.duration
-                )  # contest.start_time + timedelta(seconds=contest.duration)
-            ).do(generate_performance_files, contest=contest)
+            executor.every(
+                schedule.every(2).minutes.until(
+                    timedelta(
+                        seconds=contest.duration
+                    )  # contest.start_time + timedelta(seconds=contest.duration)
+                ),
+                contest.short_name,
+                generate_performance_files,
+                contest=contest,
+            )
 
     upcoming_contests: list[Contest] = contest_manager.upcoming_contests(
         timedelta_hours=5
@@ -50,23 +77,51 @@ def create_jobs_from_contests_list():
         if not contest.is_rated:
             continue
 
-        schedule.every(2).minutes.until(timedelta(minutes=125)).do(
-            generate_performance_files, contest=contest, commit=False
+        executor.every(
+            schedule.every(2).minutes.until(timedelta(minutes=125)),
+            contest.short_name,
+            generate_performance_files,
+            contest=contest,
+            commit=False,
+        )
+
+        # Fetch trước lịch sử thi đấu của user có khả năng tham gia cho tới khi contest bắt đầu
+        # Các contest dùng chung 1 key để chỉ có 1 lần warm chạy tại 1 thời điểm
+        executor.submit("warm", warm_competition_histories, contest=contest)
+        executor.every(
+            schedule.every(15).minutes.until(
+                contest.start_time - datetime.now().astimezone(timezone.utc)
+            ),
+            "warm",
+            warm_competition_histories,
+            contest=contest,
         )
 
     print(f"Current jobs list: {schedule.get_jobs()}")
+    print(f"Job latency:\n{executor.latency_report()}")
 
 
 # Tạo file dữ liệu cho các cuộc thi (ko kể heuristic hay algo)
 def generate_performance_files(contest: Contest, commit: bool = True) -> None:
     print(f"Generating data/{contest.short_name}_avg_perf.json file")
-    aperfs = contest.get_average_inner_performance_of_all_participants()
+    # Fetch standings 1 lần rồi dùng chung cho toàn bộ các bước bên dưới
+    standings = contest.standings_snapshot()
+    if standings is None:
+        return
+
+    aperfs = contest.get_average_inner_performance_of_all_participants(standings)
     if len(aperfs) == 0:
         return
 
-    contest.calculate_performance_in_contest(aperfs)
-    contest.dump_rounded_performance_history_of_all()
-    if commit:
+    # Phần tính toán chạy ở process khác nếu PIPELINE_PROCESSES > 0
+    changed = prediction_pool.run(
+        contest, standings, aperfs, SHARDED_HISTORY, EXACT_PERF
+    )
+    # Service trả về dữ liệu mới ngay, không cần chờ push lên github
+    if changed and SERVE_PORT is not None:
+        prediction_store.refresh(contest.short_name)
+    # Standings không đổi thì không cần commit
+    if commit and changed:
         commit_to_github(f"Calculate the prediction data for {contest.short_name}")
 
 
@@ -77,12 +132,19 @@ def update_users_perf_based_on_final_result(
     Cập nhật lịch sử thi đấu sau khi cuộc thi đã kết thúc
     """
     if contest.update_competition_history_if_fixed_result_available():
+        # Kết quả cuối cùng đã có, không còn lần dự đoán nào của contest này
+        contest.drop_aperf_state()
         commit_to_github(f"Update perfs after contest {contest.short_name}")
         return schedule.CancelJob
 
 
 if __name__ == "__main__":
-    schedule.every(1).minutes.do(create_jobs_from_contests_list)
+    if SERVE_PORT is not None:
+        start_server(int(SERVE_PORT))
+    # Danh sách contest được lấy trong thread của executor, vòng lặp chính chỉ điều phối job
+    executor.every(
+        schedule.every(1).minutes, "contests", create_jobs_from_contests_list
+    )
     while True:
-        schedule.run_pending()
+        executor.run_pending()
         time.sleep(1)
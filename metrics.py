@@ -0,0 +1,159 @@
+import functools
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from os import getenv
+
+from dotenv import load_dotenv
+
+from constants import METRICS_FILE, METRICS_HISTORY
+
+load_dotenv()
+
+# Kích thước tối đa của METRICS_HISTORY trước khi bị xoay vòng, giữ lại METRICS_BACKUPS file cũ
+METRICS_MAX_BYTES = int(getenv("METRICS_MAX_BYTES", 10 * 1024 * 1024))
+METRICS_BACKUPS = int(getenv("METRICS_BACKUPS", 5))
+
+# Contest của tick đang chạy trong thread hiện tại, dùng làm label cho mọi metric
+current_contest: ContextVar[str] = ContextVar("current_contest", default="")
+
+_TYPES = {
+    "acperf_stage_duration_seconds": "summary",
+    "acperf_stage_last_duration_seconds": "gauge",
+    "acperf_fetch_requests_total": "counter",
+    "acperf_fetch_cache_total": "counter",
+    "acperf_fetch_retries_total": "counter",
+    "acperf_fetch_retry_sleep_seconds_total": "counter",
+    "acperf_bytes_written_total": "counter",
+}
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metrics:
+    """
+    Thời gian chạy từng bước và số lượng request/cache/retry/bytes đã ghi, theo từng contest
+    Được ghi ra METRICS_FILE theo định dạng text của Prometheus sau mỗi tick
+    METRICS_FILE chỉ chứa giá trị hiện tại (cho scraper đọc), METRICS_HISTORY lưu lại từng lần ghi
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (name, labels) -> value, labels là tuple các cặp (key, value) đã sort
+        self.values: dict[tuple[str, tuple], float] = {}
+        self.history: logging.Logger | None = None
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, self._labels(labels))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self.lock:
+            self.values[(name, self._labels(labels))] = value
+
+    @staticmethod
+    def _labels(labels: dict) -> tuple:
+        labels.setdefault("contest", current_contest.get())
+        return tuple(sorted(labels.items()))
+
+    # Lấy ra toàn bộ giá trị rồi xóa đi, process con dùng để gửi metric về process chính
+    def drain(self) -> dict[tuple[str, tuple], float]:
+        with self.lock:
+            values, self.values = self.values, {}
+        return values
+
+    # Gộp giá trị lấy từ drain() của process con: gauge được ghi đè, còn lại được cộng dồn
+    def merge(self, values: dict[tuple[str, tuple], float]) -> None:
+        with self.lock:
+            for key, value in values.items():
+                if _TYPES.get(key[0]) == "gauge":
+                    self.values[key] = value
+                else:
+                    self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, stage: str, seconds: float) -> None:
+        self.inc("acperf_stage_duration_seconds_sum", seconds, stage=stage)
+        self.inc("acperf_stage_duration_seconds_count", stage=stage)
+        self.set("acperf_stage_last_duration_seconds", seconds, stage=stage)
+
+    @contextmanager
+    def stage(self, stage: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - start)
+
+    # Decorator: đo thời gian chạy của cả hàm
+    def timed(self, stage: str):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    @contextmanager
+    def tick(self, contest: str, stage: str):
+        """
+        1 lần chạy job của contest: mọi metric ghi trong thread này (và trong fetch_concurrently) có label contest
+        Xong thì ghi metric ra file
+        """
+        token = current_contest.set(contest)
+        try:
+            with self.stage(stage):
+                yield
+        finally:
+            current_contest.reset(token)
+            self.export()
+
+    def render(self) -> str:
+        with self.lock:
+            values = sorted(self.values.items())
+        lines: list[str] = []
+        declared: set[str] = set()
+        for (name, labels), value in values:
+            family = name.removesuffix("_sum").removesuffix("_count")
+            family = family if family in _TYPES else name
+            if family not in declared:
+                declared.add(family)
+                lines.append(f"# TYPE {family} {_TYPES.get(family, 'untyped')}")
+            label_text = ",".join(f'{key}="{_escape(value)}"' for key, value in labels)
+            lines.append(f"{name}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self) -> None:
+        text = self.render()
+        os.makedirs(os.path.dirname(METRICS_FILE), exist_ok=True)
+        # Ghi ra file tạm rồi rename để scraper không đọc phải file ghi dở
+        tmp = f"{METRICS_FILE}.{threading.get_ident()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, METRICS_FILE)
+
+        with self.lock:
+            if self.history is None:
+                self.history = logging.getLogger("acperf.metrics")
+                self.history.propagate = False
+                self.history.setLevel(logging.INFO)
+                self.history.addHandler(
+                    logging.handlers.RotatingFileHandler(
+                        METRICS_HISTORY,
+                        maxBytes=METRICS_MAX_BYTES,
+                        backupCount=METRICS_BACKUPS,
+                    )
+                )
+        self.history.info(f"# {time.strftime('%Y-%m-%dT%H:%M:%S')}\n{text}")
+
+
+metrics = Metrics()
@@ -0,0 +1,160 @@
+import math
+
+import numpy as np
+
+# Số perf được tính cùng lúc, mỗi lần tạo 1 ma trận (số participant x PERF_CHUNK_SIZE)
+PERF_CHUNK_SIZE = 256
+
+# Kết quả tính bằng numpy có thể lệch vài ulp so với pow() của Python
+# Sai số cộng dồn với 30k+ participant vẫn nhỏ hơn rất nhiều so với ngưỡng này,
+# các phép so sánh sát hơn ngưỡng được tính lại bằng vòng lặp để output giống hệt cách cũ
+EXACT_TOLERANCE = 1e-9
+
+# Nội suy tuyến tính ngược giữa 2 perf nguyên lệch tối đa ln(6) / 400 / 8 ~ 6e-4 điểm
+# Perf gần x.5 hơn ngưỡng này được làm tròn bằng cách tính expected rank tại x.5
+ROUNDING_TOLERANCE = 1e-3
+
+
+# Expected rank của 1 perf, bản tính từng phần tử của expected_ranks()
+def expected_rank(perf: float, aperfs: list[float]) -> float:
+    ans = 0
+    for aperf in aperfs:
+        ans += 1 / (1 + pow(6.0, (perf - aperf) / 400.0))
+    ans += 0.5
+    return ans
+
+
+def expected_ranks(perfs: np.ndarray, aperfs: np.ndarray) -> np.ndarray:
+    """
+    Expected rank của nhiều perf cùng lúc
+    Cộng theo axis 0 nên các aperf được cộng lần lượt theo đúng thứ tự như expected_rank()
+    """
+    # 6^((perf - aperf) / 400) = 6^(perf / 400) * 6^(-aperf / 400)
+    # Tích ngoài rẻ hơn rất nhiều so với gọi pow cho từng cặp
+    scale = np.multiply.outer(
+        np.power(6.0, -aperfs / 400.0), np.power(6.0, perfs / 400.0)
+    )
+    terms = 1 / (1 + scale)
+    return terms.sum(axis=0) + 0.5
+
+
+# ranks[i] = expected rank của perf (max_perf - i), tính tiếp cho tới khi vượt quá số participant
+def _expected_ranks_from_max_perf(aperfs: np.ndarray, max_perf: int) -> np.ndarray:
+    chunks: list[np.ndarray] = []
+    top_perf = max_perf
+    while True:
+        perfs = np.arange(top_perf, top_perf - PERF_CHUNK_SIZE, -1, dtype=np.float64)
+        chunks.append(expected_ranks(perfs, aperfs))
+        if chunks[-1][-1] >= len(aperfs):
+            return np.concatenate(chunks)
+        top_perf -= PERF_CHUNK_SIZE
+
+
+def performance_by_rank(aperfs: list[float] | np.ndarray, max_perf: int) -> list[int]:
+    """
+    Dựa vào aperf của toàn bộ participant, tính ra performance của người thứ 1, 2, ..., n
+    Kết quả giống hệt cách cũ (giảm dần từ max_perf từng điểm một) nhưng được tính theo lô
+    @return [perf của hạng 1, perf của hạng 2, ...]
+    """
+    n = len(aperfs)
+    if n == 0:
+        return []
+
+    aperf_arr = np.asarray(aperfs, dtype=np.float64)
+    ranks = _expected_ranks_from_max_perf(aperf_arr, max_perf)
+
+    exact_ranks: dict[int, float] = {}
+
+    def exact_rank_at(i: int) -> float:
+        if i not in exact_ranks:
+            # tolist() trả về float của Python, np.float64 sẽ khiến pow() lại tính bằng numpy
+            exact_ranks[i] = expected_rank(max_perf - i, aperf_arr.tolist())
+        return exact_ranks[i]
+
+    # Rank of the top users will be rounded down to contest.max_perf
+    # So they have the same performance of contest.max_perf
+    top = ranks[0]
+    if abs(top - round(top)) < EXACT_TOLERANCE:
+        top = exact_rank_at(0)
+    top_rank = math.floor(top)
+
+    # Với mỗi rank, cur_perf là perf cao nhất có expected rank >= rank
+    # rồi chọn cur_perf hoặc cur_perf + 1 tùy theo cái nào gần rank hơn
+    targets = np.arange(top_rank + 1, n + 1, dtype=np.float64)
+    idx = np.searchsorted(ranks, targets, side="left")
+    diff1 = np.abs(ranks[idx] - targets)
+    diff2 = np.abs(ranks[idx - 1] - targets)
+    perfs = max_perf - idx + (diff1 >= diff2)
+
+    ambiguous = (
+        (diff1 < EXACT_TOLERANCE)
+        | (diff2 < EXACT_TOLERANCE)
+        | (np.abs(diff1 - diff2) < EXACT_TOLERANCE)
+    )
+    for k in np.flatnonzero(ambiguous):
+        rank = int(targets[k])
+        i = max(int(idx[k]), 1)
+        while exact_rank_at(i) < rank:
+            i += 1
+        while i > 1 and exact_rank_at(i - 1) >= rank:
+            i -= 1
+        exact_diff1 = abs(exact_rank_at(i) - rank)
+        exact_diff2 = abs(exact_rank_at(i - 1) - rank)
+        perfs[k] = max_perf - i if exact_diff1 < exact_diff2 else max_perf - i + 1
+
+    return [max_perf] * top_rank + perfs.tolist()
+
+
+def fractional_performance_by_rank(
+    aperfs: list[float] | np.ndarray, max_perf: int
+) -> np.ndarray:
+    """
+    Performance của người thứ 1, 2, ..., n dạng số thực
+    Giải expected_rank(perf) = rank trên đường cong liên tục: binary search tìm 2 perf nguyên kẹp rank,
+    sau đó nội suy ngược trong khoảng đó
+    Perf lớn hơn max_perf được làm tròn xuống max_perf
+    @return np.ndarray [perf của hạng 1, perf của hạng 2, ...]
+    """
+    n = len(aperfs)
+    if n == 0:
+        return np.empty(0)
+
+    ranks = _expected_ranks_from_max_perf(
+        np.asarray(aperfs, dtype=np.float64), max_perf
+    )
+    targets = np.arange(1, n + 1, dtype=np.float64)
+    # expected_rank(max_perf - idx) >= rank > expected_rank(max_perf - idx + 1)
+    idx = np.searchsorted(ranks, targets, side="left")
+    lower = ranks[idx]
+    upper = ranks[np.maximum(idx - 1, 0)]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        frac = np.where(idx > 0, (lower - targets) / (lower - upper), 0.0)
+    return max_perf - idx + frac
+
+
+def rounded_performance_by_rank(
+    aperfs: list[float] | np.ndarray, max_perf: int
+) -> list[int]:
+    """
+    Performance chính xác của từng hạng, làm tròn như Atcoder (x.5 được làm tròn lên)
+    thay vì chọn perf nguyên có expected rank gần nhất
+    @return [perf của hạng 1, perf của hạng 2, ...]
+    """
+    perfs = fractional_performance_by_rank(aperfs, max_perf)
+    rounded = np.floor(perfs + 0.5)
+
+    # perf >= q + 0.5 <=> expected_rank(q + 0.5) >= rank do đường cong giảm dần
+    halves = np.floor(perfs) + 0.5
+    ambiguous = np.flatnonzero(
+        (np.abs(perfs - halves) < ROUNDING_TOLERANCE) & (perfs < max_perf)
+    )
+    if len(ambiguous) > 0:
+        half_ranks = expected_ranks(
+            halves[ambiguous], np.asarray(aperfs, dtype=np.float64)
+        )
+        rounded[ambiguous] = np.where(
+            half_ranks >= ambiguous + 1,
+            halves[ambiguous] + 0.5,
+            halves[ambiguous] - 0.5,
+        )
+    return rounded.astype(np.int64).tolist()
@@ -0,0 +1,173 @@
+"""
+Phần tính toán của generate_performance_files: perf theo thứ hạng, dump lịch sử thi đấu, dự đoán rating
+Khi có nhiều contest diễn ra cùng lúc (ABC + ARC + AHC), các bước này chỉ dùng được 1 core do GIL
+PIPELINE_PROCESSES > 0: mỗi lần chạy được gửi sang 1 process trong pool, aperf được truyền qua shared memory
+Fetch standings, tính aperf, refresh service và commit vẫn chạy ở process chính
+
+Process con không bao giờ được fetch: rate_limiter của fetch chỉ có tác dụng trong 1 process
+Lịch sử thi đấu còn thiếu được fetch ở process chính trước khi gửi sang process con
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from os import getenv
+
+import numpy as np
+from dotenv import load_dotenv
+
+from contest import Contest, Standings
+from history import HistoryColumns
+from history_store import history_store
+from metrics import current_contest, metrics
+from util import reset_written_digests
+
+load_dotenv()
+
+# Số process tính toán, 0: chạy ngay trong thread của job như trước
+PIPELINE_PROCESSES = int(getenv("PIPELINE_PROCESSES", 0))
+
+
+def build_prediction_files(
+    contest: Contest,
+    standings: Standings,
+    aperfs: np.ndarray,
+    sharded: bool,
+    exact: bool = False,
+) -> bool:
+    """
+    Tạo file perf theo thứ hạng, lịch sử thi đấu của toàn bộ participant và dự đoán rating
+    exact: tính perf bằng cách giải phương trình expected rank (xem calculate_performance_in_contest)
+    @return True nếu có file thay đổi
+    """
+    perfs = contest.calculate_performance_in_contest(
+        aperfs, save_to_file=False, exact=exact
+    )
+    perfs_changed = contest.save_performance_in_contest(perfs)
+    # Lịch sử thi đấu được load theo từng lô trong lúc ghi file,
+    # chỉ những cột cần cho dự đoán rating được giữ lại
+    columns = HistoryColumns(contest.type)
+    history_changed = contest.dump_rounded_performance_history_of_all(
+        standings, sharded, columns
+    )
+    rating_changed = contest.save_rating_prediction(
+        contest.predict_ratings(standings, perfs, columns)
+    )
+    return perfs_changed or history_changed or rating_changed
+
+
+# Chạy trong process con
+# Return (có file thay đổi không, metric ghi được trong lần chạy này)
+def _build_in_worker(
+    contest: Contest,
+    standings: Standings,
+    name: str,
+    size: int,
+    sharded: bool,
+    exact: bool,
+) -> tuple[bool, dict]:
+    token = current_contest.set(contest.short_name)
+    # Contest có thể được chạy ở process khác trong lần trước, digest đang nhớ có thể đã cũ
+    reset_written_digests()
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        changed = build_prediction_files(
+            contest,
+            standings,
+            np.ndarray((size,), dtype=np.float64, buffer=shm.buf),
+            sharded,
+            exact,
+        )
+    finally:
+        current_contest.reset(token)
+    # Chỉ close được khi không còn array nào trỏ vào buffer
+    shm.close()
+    return changed, metrics.drain()
+
+
+class PredictionPool:
+    """
+    Process pool cho build_prediction_files, được tạo khi có lần chạy đầu tiên
+    Dùng spawn thay vì fork: process chính có nhiều thread và đang giữ kết nối SQLite
+    """
+
+    def __init__(self, processes: int = PIPELINE_PROCESSES):
+        self.processes = processes
+        self.lock = threading.Lock()
+        self.pool: ProcessPoolExecutor | None = None
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self.pool
+
+    # Pool bị hỏng khi 1 process con chết đột ngột (hết bộ nhớ, segfault...), mọi lần submit sau đều lỗi
+    def _discard(self, pool: ProcessPoolExecutor) -> None:
+        with self.lock:
+            if self.pool is pool:
+                self.pool = None
+        pool.shutdown(wait=False)
+
+    # Fetch (ở process chính) lịch sử của rated user chưa có trong store để process con chỉ cần đọc store
+    @staticmethod
+    def _fetch_missing_histories(contest: Contest, standings: Standings) -> None:
+        from user import competition_histories
+
+        usernames = standings.rated_participants
+        stored = history_store().updated_at_many(contest.type, usernames)
+        missing = [username for username in usernames if username not in stored]
+        if len(missing) > 0:
+            competition_histories(missing, contest.type)
+
+    def run(
+        self,
+        contest: Contest,
+        standings: Standings,
+        aperfs: np.ndarray,
+        sharded: bool,
+        exact: bool = False,
+    ) -> bool:
+        if self.processes <= 0:
+            return build_prediction_files(contest, standings, aperfs, sharded, exact)
+
+        self._fetch_missing_histories(contest, standings)
+        aperfs = np.ascontiguousarray(aperfs, dtype=np.float64)
+        # SharedMemory không cho phép size = 0
+        shm = shared_memory.SharedMemory(create=True, size=max(aperfs.nbytes, 1))
+        try:
+            np.ndarray(aperfs.shape, dtype=np.float64, buffer=shm.buf)[:] = aperfs
+            # Pool bị hỏng thì tạo pool mới và chạy lại 1 lần
+            for attempt in range(2):
+                pool = self._pool()
+                try:
+                    changed, values = pool.submit(
+                        _build_in_worker,
+                        contest,
+                        standings,
+                        shm.name,
+                        len(aperfs),
+                        sharded,
+                        exact,
+                    ).result()
+                    break
+                except BrokenProcessPool:
+                    self._discard(pool)
+                    if attempt == 1:
+                        raise
+                    print(
+                        f"Process pool broken while building {contest.short_name}, retrying in a new pool"
+                    )
+        finally:
+            shm.close()
+            shm.unlink()
+        metrics.merge(values)
+        return changed
+
+
+prediction_pool = PredictionPool()
@@ -0,0 +1,190 @@
+import math
+from datetime import datetime
+
+import numpy as np
+
+from aperf import DECAY
+from history import HistoryColumns
+
+# Ngày theo giờ Nhật (UTC+9), Atcoder tính khoảng cách giữa 2 contest theo ngày ở đây
+JST_OFFSET = 9 * 60 * 60  # seconds
+
+
+def _positivize(rating: np.ndarray) -> np.ndarray:
+    # Rating dưới 400 được co lại để luôn dương
+    return np.where(
+        rating <= 400, 400 / np.exp((400 - np.minimum(rating, 400)) / 400), rating
+    )
+
+
+# Làm tròn như Atcoder, x.5 được làm tròn lên
+def round_ratings(ratings: np.ndarray) -> np.ndarray:
+    return np.floor(ratings + 0.5).astype(np.int64)
+
+
+def _pad_flat(values: np.ndarray, counts: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Ghép lịch sử của từng user thành 1 ma trận, căn phải: cột cuối là contest gần nhất
+    values: lịch sử của mọi user nối liền nhau, user i có counts[i] phần tử
+    @return (ma trận (n, m), mask các ô có dữ liệu)
+    """
+    n = len(counts)
+    width = int(counts.max()) if n > 0 else 0
+    rows = np.repeat(np.arange(n), counts)
+    starts = np.repeat(np.cumsum(counts) - counts, counts)
+    columns = np.arange(len(values)) - starts + np.repeat(width - counts, counts)
+    matrix = np.zeros((n, width))
+    mask = np.zeros((n, width), dtype=bool)
+    matrix[rows, columns] = values
+    mask[rows, columns] = True
+    return matrix, mask
+
+
+def _expand(values: np.ndarray, perfs: np.ndarray) -> np.ndarray:
+    # Cho phép perfs có shape (n,) hoặc (n, k)
+    return values if perfs.ndim == 1 else values[:, None]
+
+
+def _f(counts: np.ndarray) -> np.ndarray:
+    # Rating bị trừ đi khi số contest còn ít: F(1) = 1200, F(∞) = 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (
+            1200
+            * (np.sqrt(1 - 0.81**counts) / (1 - DECAY**counts) - 1)
+            / (math.sqrt(19) - 1)
+        )
+
+
+def algo_ratings(
+    columns: HistoryColumns, perfs: np.ndarray
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Rating hiện tại và rating sau contest này của nhiều user cùng lúc (algo)
+    R = 800 * log2(sum(2^(P_i / 800) * 0.9^i) / sum(0.9^i)) - F(n), P_1 là contest gần nhất
+    columns: RoundedPerformance của từng user
+    perfs: perf của từng user ở contest này, shape (n,) hoặc (n, k) để thử k perf cho mỗi user
+    @return (rating hiện tại (0 nếu chưa thi contest nào), rating mới), chưa làm tròn
+    """
+    perfs = np.asarray(perfs, dtype=np.float64)
+    counts = np.asarray(columns.counts, dtype=np.int64)
+    matrix, mask = _pad_flat(
+        np.asarray(columns.rounded_performance, dtype=np.float64), counts
+    )
+    decay = DECAY ** np.arange(matrix.shape[1], 0, -1)
+    weighted = np.where(mask, np.power(2.0, matrix / 800) * decay, 0).sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        old = 800 * np.log2(weighted / (9 * (1 - DECAY**counts))) - _f(counts)
+    old = np.where(counts > 0, _positivize(np.nan_to_num(old)), 0)
+
+    new_weighted = DECAY * (np.power(2.0, perfs / 800) + _expand(weighted, perfs))
+    new = 800 * np.log2(
+        new_weighted / _expand(9 * (1 - DECAY ** (counts + 1)), perfs)
+    ) - _expand(_f(counts + 1), perfs)
+    return old, _positivize(new)
+
+
+# unix time -> số ngày tính theo giờ Nhật
+def jst_days(end_times: np.ndarray) -> np.ndarray:
+    return (end_times + JST_OFFSET) // (24 * 60 * 60)
+
+
+def jst_day(end_time: datetime) -> int:
+    return (int(end_time.timestamp()) + JST_OFFSET) // (24 * 60 * 60)
+
+
+def _sort_heuristic(
+    values: np.ndarray, weights: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    values: performance đã giảm theo thời gian, ô không có dữ liệu là -inf
+    R = sum(Q_i * (0.9^S_(i-1) - 0.9^S_i)), Q sắp xếp giảm dần, S_i là tổng weight của i contest đầu
+    @return (Q đã sắp xếp, S tương ứng, Q_i * (0.9^S_(i-1) - 0.9^S_i))
+    """
+    order = np.argsort(-values, axis=1, kind="stable")
+    values = np.take_along_axis(values, order, axis=1)
+    weights = np.take_along_axis(weights, order, axis=1)
+    cumulative = np.cumsum(weights, axis=1)
+    contributions = np.where(np.isfinite(values), values, 0) * (
+        DECAY ** (cumulative - weights) - DECAY**cumulative
+    )
+    return values, cumulative, contributions
+
+
+class HeuristicHistories:
+    """
+    Lịch sử thi đấu heuristic của nhiều user dạng cột: perf, weight, ngày kết thúc của mọi user nối liền nhau
+    Thời gian kết thúc (unix time) của toàn bộ user được đổi 1 lần thành số ngày (giờ Nhật)
+    Dùng để tính performance đã giảm theo thời gian + weight của toàn bộ user trong 1 lần
+    """
+
+    def __init__(self, columns: HistoryColumns):
+        self.counts = np.asarray(columns.counts, dtype=np.int64)
+        self.perfs = np.asarray(columns.inner_performance, dtype=np.float64)
+        self.weights = np.asarray(columns.weights, dtype=np.float64)
+        self.days = jst_days(np.asarray(columns.end_times, dtype=np.int64))
+
+    def performance_sets(
+        self, end_day: int | None = None
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Performance đã giảm theo thời gian Q = P + 150 - 100 * (end_day - ngày của contest) / 365
+        end_day = None: tính tới ngày của contest gần nhất của từng user (rating hiện tại)
+        @return (Q của từng user sắp xếp giảm dần, S tương ứng, Q_i * (0.9^S_(i-1) - 0.9^S_i)), mỗi user 1 dòng
+        """
+        matrix, mask = _pad_flat(self.perfs, self.counts)
+        weights, _ = _pad_flat(self.weights, self.counts)
+        days, _ = _pad_flat(self.days.astype(np.float64), self.counts)
+        reference = days[:, -1:] if end_day is None else end_day
+        values = np.where(mask, matrix + 150 - 100 * (reference - days) / 365, -np.inf)
+        return _sort_heuristic(values, weights)
+
+    def ratings(
+        self, perfs: np.ndarray, weight: float, end_day: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Rating hiện tại và rating sau contest này (heuristic)
+        perfs: perf của từng user ở contest này, shape (n,) hoặc (n, k)
+        weight, end_day: weight và ngày kết thúc (jst_day) của contest này
+        @return (rating hiện tại (0 nếu chưa thi contest nào), rating mới), chưa làm tròn
+        """
+        perfs = np.asarray(perfs, dtype=np.float64)
+        _, _, old_contributions = self.performance_sets()
+        old = np.where(self.counts > 0, _positivize(old_contributions.sum(axis=1)), 0)
+        sorted_values, cumulative, contributions = self.performance_sets(end_day)
+        return old, _insert_heuristic(
+            sorted_values, cumulative, contributions, perfs + 150, weight
+        )
+
+
+def _insert_heuristic(
+    sorted_values: np.ndarray,
+    cumulative: np.ndarray,
+    contributions: np.ndarray,
+    values: np.ndarray,
+    weight: float,
+) -> np.ndarray:
+    """
+    Rating sau khi thêm contest này (performance values, chưa có ngày nào trôi qua) vào dãy đã sắp xếp
+    Các contest đứng sau contest mới có S tăng thêm weight nên đóng góp nhân thêm 0.9^weight
+    """
+    n = len(sorted_values)
+    # prefix[:, t], starts[:, t]: tổng đóng góp và tổng weight của t contest đầu
+    prefix = np.concatenate(
+        [np.zeros((n, 1)), np.cumsum(contributions, axis=1)], axis=1
+    )
+    starts = np.concatenate([np.zeros((n, 1)), cumulative], axis=1)
+
+    rows = np.arange(n)
+    if values.ndim == 2:
+        rows = rows[:, None]
+        position = (sorted_values[:, None, :] > values[:, :, None]).sum(axis=2)
+    else:
+        position = (sorted_values > values[:, None]).sum(axis=1)
+
+    before = prefix[rows, position]
+    after = (prefix[rows, -1] - before) * DECAY**weight
+    start = starts[rows, position]
+    return _positivize(
+        before + values * (DECAY**start - DECAY ** (start + weight)) + after
+    )
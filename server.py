@@ -0,0 +1,192 @@
+"""
+Service chỉ đọc trả về dữ liệu dự đoán của contest ngay sau mỗi lần generate_performance_files
+thay vì chờ commit + push lên github
+
+Chạy chung process với main.py (SERVE_PORT=8000) hoặc riêng: gunicorn server:app
+GET /contests/<contest>/perfs: giống data/{contest}_ranking_to_perf.json
+GET /contests/<contest>/histories: giống data/{contest}_rounded_perf_history.json
+GET /contests/<contest>/users/<username>: lịch sử thi đấu của 1 user trong file trên
+GET /contests/<contest>/ratings/<username>: [rated rank, perf, rating hiện tại, rating mới] của 1 user
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+
+from dotenv import load_dotenv
+from flask import Flask, Response, abort, request
+
+from constants import (
+    ALL_PARTICIPANTS_ROUNDED_PERF_HISTORY,
+    PERF_BY_RANKING,
+    RATING_PREDICTION,
+)
+
+load_dotenv()
+
+# Số contest tối đa được giữ trong bộ nhớ, contest ít được truy cập nhất bị loại ra trước
+SERVE_MAX_CONTESTS = int(getenv("SERVE_MAX_CONTESTS", 8))
+# Khoảng thời gian (giây) giữa 2 lần kiểm tra file dữ liệu có thay đổi không (khi chạy riêng process)
+SERVE_CHECK_INTERVAL = float(getenv("SERVE_CHECK_INTERVAL", 1))
+
+
+class Payload:
+    """
+    Nội dung của 1 response: bytes gốc, bytes đã nén gzip sẵn và ETag
+    """
+
+    def __init__(self, body: bytes):
+        self.body = body
+        self.gzipped = gzip.compress(body, mtime=0)
+        self.etag = hashlib.sha1(body).hexdigest()
+
+
+class ContestData:
+    """
+    Dữ liệu dự đoán của 1 contest tại 1 thời điểm
+    Cập nhật bằng cách tạo ContestData mới rồi thay vào PredictionStore, request đang xử lý vẫn dùng bản cũ
+    """
+
+    def __init__(self, contest: str):
+        self.checked_at = time.monotonic()
+        self.files = [
+            # algo và heuristic dùng chung định dạng tên file
+            PERF_BY_RANKING["algo"].format(contest),
+            ALL_PARTICIPANTS_ROUNDED_PERF_HISTORY.format(contest),
+            RATING_PREDICTION.format(contest),
+        ]
+        self.mtimes = self.file_mtimes(self.files)
+        self.perfs = self._read(self.files[0])
+        self.histories = self._read(self.files[1])
+        self.ratings = self._read(self.files[2])
+        self.users: dict[str, dict] = {
+            "histories": (
+                {} if self.histories is None else json.loads(self.histories.body)
+            ),
+            "ratings": ({} if self.ratings is None else json.loads(self.ratings.body)),
+        }
+        self.user_payloads: dict[tuple[str, str], Payload] = {}
+
+    # Dữ liệu của 1 user trong users[kind], chỉ được encode khi có request
+    def user(self, kind: str, username: str) -> Payload | None:
+        if username not in self.users[kind]:
+            return None
+        if (kind, username) not in self.user_payloads:
+            self.user_payloads[(kind, username)] = Payload(
+                json.dumps(self.users[kind][username]).encode()
+            )
+        return self.user_payloads[(kind, username)]
+
+    @staticmethod
+    def file_mtimes(files: list[str]) -> list[int | None]:
+        return [
+            os.stat(file).st_mtime_ns if os.path.exists(file) else None
+            for file in files
+        ]
+
+    @staticmethod
+    def _read(file: str) -> Payload | None:
+        if not os.path.exists(file):
+            return None
+        with open(file, "rb") as f:
+            return Payload(f.read())
+
+
+class PredictionStore:
+    def __init__(self, max_contests: int = SERVE_MAX_CONTESTS):
+        self.max_contests = max_contests
+        self.lock = threading.Lock()
+        self.contests: OrderedDict[str, ContestData] = OrderedDict()
+
+    # Load lại dữ liệu của contest từ file rồi thay thế bản cũ
+    # Return None nếu contest không có file dữ liệu nào
+    def refresh(self, contest: str) -> ContestData | None:
+        data = ContestData(contest)
+        with self.lock:
+            if data.perfs is None and data.histories is None and data.ratings is None:
+                self.contests.pop(contest, None)
+                return None
+            self.contests[contest] = data
+            self.contests.move_to_end(contest)
+            while len(self.contests) > self.max_contests:
+                self.contests.popitem(last=False)
+        return data
+
+    def get(self, contest: str) -> ContestData | None:
+        with self.lock:
+            data = self.contests.get(contest)
+            if data is not None:
+                self.contests.move_to_end(contest)
+        if data is None:
+            return self.refresh(contest)
+        if time.monotonic() - data.checked_at >= SERVE_CHECK_INTERVAL:
+            if ContestData.file_mtimes(data.files) != data.mtimes:
+                return self.refresh(contest)
+            data.checked_at = time.monotonic()
+        return data
+
+
+prediction_store = PredictionStore()
+app = Flask(__name__)
+
+
+def _respond(payload: Payload | None, content_type: str = "application/json"):
+    if payload is None:
+        abort(404)
+    use_gzip = "gzip" in request.accept_encodings
+    # Mỗi encoding là 1 bản khác nhau nên cần ETag khác nhau
+    etag = f"{payload.etag}-gz" if use_gzip else payload.etag
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(
+            payload.gzipped if use_gzip else payload.body, content_type=content_type
+        )
+        if use_gzip:
+            response.headers["Content-Encoding"] = "gzip"
+    response.set_etag(etag)
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.get("/contests/<contest>/perfs")
+def contest_perfs(contest: str):
+    data = prediction_store.get(contest)
+    return _respond(None if data is None else data.perfs)
+
+
+@app.get("/contests/<contest>/histories")
+def contest_histories(contest: str):
+    data = prediction_store.get(contest)
+    return _respond(None if data is None else data.histories)
+
+
+@app.get("/contests/<contest>/users/<username>")
+def user_history(contest: str, username: str):
+    data = prediction_store.get(contest)
+    return _respond(None if data is None else data.user("histories", username))
+
+
+@app.get("/contests/<contest>/ratings/<username>")
+def user_rating(contest: str, username: str):
+    data = prediction_store.get(contest)
+    return _respond(None if data is None else data.user("ratings", username))
+
+
+def start_server(port: int) -> None:
+    threading.Thread(
+        target=app.run,
+        kwargs={
+            "host": "0.0.0.0",
+            "port": port,
+            "threaded": True,
+            "use_reloader": False,
+        },
+        daemon=True,
+    ).start()
@@ -1,11 +1,13 @@
-import json
-import os
 from datetime import datetime, timezone
-from typing import Literal
+from typing import Iterator, Literal
 
-from constants import COMPETITION_HISTORY, COMPETITION_HISTORY_URL
+from aperf import decayed_average
+from constants import COMPETITION_HISTORY_URL
 from contest import Contest, ContestManager
-from fetch import fetch
+from fetch import fetch, fetch_each_concurrently
+from history import CompetitionHistory
+from history_store import history_store
+from metrics import metrics
 
 
 class User:
@@ -20,22 +22,13 @@ class User:
     # Lấy ra performance trung bình của 1 user
     # Áp dụng cho cả algo và heuristic
     # Note: hiện tại hàm tính performance trung bình của từng người dùng đang đúng
-    # Performance tính bằng binary search đang lệch +- 5 điểm (Đang sai lệch): TODO
+    # Performance chọn theo perf nguyên gần nhất (mặc định) lệch +- vài điểm so với Atcoder,
+    # EXACT_PERF=1 giải phương trình expected rank rồi làm tròn như Atcoder (rounded_performance_by_rank)
     # Khi có performance, dựa vào lịch sử thi đấu tính rating đang đúng
     def average_inner_performance(self, contest: Contest):
-        chistory: dict[str, list[int]] = self.competition_history(contest.type)
-        perf_arr = chistory["InnerPerformance"]
-
-        if len(perf_arr) == 0:
-            return contest.new_comer_aperf
-
-        perf_arr.reverse()
-        numerator: float = 0
-        denominator: float = 0
-        for i in range(len(perf_arr)):
-            numerator += pow(0.9, i + 1) * perf_arr[i]
-            denominator += pow(0.9, i + 1)
-        return numerator / denominator
+        chistory = self.competition_history(contest.type)
+        aperf = decayed_average(chistory.inner_performance)
+        return contest.new_comer_aperf if aperf is None else aperf
 
     # Chạy cho heuristic contest - ko dùng tới - phần này client dùng chứ ko có ở server
     # def decayedPerformance(self, competion_history: dict[str, List[int]]) -> List[float]:
@@ -49,10 +42,10 @@ class User:
 
     #     return result
 
-    def fetch_competition_history(self, contest_type: str):
+    def fetch_competition_history(self, contest_type: str) -> CompetitionHistory:
         # Lấy dữ liệu lịch sử thi đấu của 1 người dùng với contest_type từ trên Atcoder xuống.
         """
-        @return
+        @return CompetitionHistory, to_dict() có dạng
         dict {
             'RoundedPerformance': [100, 2400, ...],
             'InnerPerformance': [100, 3000, ...],
@@ -64,83 +57,110 @@ class User:
         data = fetch(
             COMPETITION_HISTORY_URL[contest_type].format(self.username), "json"
         )
-        result: dict[str, list[int]] = {
-            "RoundedPerformance": [],
-            "InnerPerformance": [],
-            "ContestEndTime": [],
-            "Weight": [],
-            "ContestShortName": [],
-        }
+        result = CompetitionHistory()
         contestManager = ContestManager()
         for item in data:
             if item.get("IsRated"):
                 ContestShortName = item.get("ContestScreenName").split(".")[0]
-                result["RoundedPerformance"].append(item.get("Performance"))
-                result["InnerPerformance"].append(item.get("InnerPerformance"))
-                endTime = (
-                    datetime.fromisoformat(item.get("EndTime"))
-                    .astimezone(timezone.utc)
-                    .strftime("%Y-%m-%d %H:%M:%S")
-                )
-                # datetime.strptime(endTime, '%Y-%m-%d %H:%M:%S') - convert it back to datetime object
-                result["ContestEndTime"].append(endTime)
                 if contest_type == "algo":
-                    result["Weight"].append(1)
+                    weight = 1
                 else:
                     contest = contestManager.find_contest(ContestShortName)
-                    result["Weight"].append(contest["weight"])
-                result["ContestShortName"].append(ContestShortName)
+                    weight = contest["weight"]
+                result.append(
+                    item.get("Performance"),
+                    item.get("InnerPerformance"),
+                    datetime.fromisoformat(item.get("EndTime")).astimezone(
+                        timezone.utc
+                    ),
+                    weight,
+                    ContestShortName,
+                )
         return result
 
     # Lưu lại lịch sử performance của người dùng
-    def save_performance_history(self, data: dict[str, list[int]], contest_type: str):
-        file = COMPETITION_HISTORY.format(
-            contest_type=contest_type, username=self.username
-        )
-        with open(file, "w") as f:
-            json.dump(data, f, default=str)
+    def save_performance_history(self, data: CompetitionHistory, contest_type: str):
+        history_store().upsert(contest_type, self.username, data)
 
     def competition_history(
         self, contest_type: Literal["algo", "heuristic"], refresh: bool = False
-    ):
+    ) -> CompetitionHistory:
         # Lấy ra lịch sử thi đấu của người dùng, nếu chưa có thì fetch từ Atcoder xuống
         # refresh = True: luôn fetch từ Atcoder xuống (do dữ liệu hiện tại đã cũ - số lần thi đầu ở local != Competitions tại API)
         """
-        @return dict {
-            'InnerPerformance': [],
-            'RoundedPerformance': [],
-            'ContestEndTime': [],
-            'Weight': [],
-            'ContestShortName': []
-        }
+        @return CompetitionHistory, xem fetch_competition_history
         """
-        file = COMPETITION_HISTORY.format(
-            contest_type=contest_type, username=self.username
-        )
-        if refresh or not os.path.exists(file):
+        perfs = None if refresh else history_store().load(contest_type, self.username)
+        if perfs is None:
             perfs = self.fetch_competition_history(contest_type)
             self.save_performance_history(perfs, contest_type)
-            return perfs
-
-        with open(f"competition-history/{contest_type}/{self.username}.json", "r") as f:
-            return json.load(f)
+        return perfs
 
     def sync_competition_history(self, contest_type: Literal["algo", "heuristic"]):
         perfs = self.fetch_competition_history(contest_type)
         self.save_performance_history(perfs, contest_type)
 
-    # So sánh nếu số lần tham gia contest lấy từ Atcoder và local khác nhau thì xóa file vì dữ liệu ko khớp
+    # So sánh nếu số lần tham gia contest lấy từ Atcoder và local khác nhau thì xóa vì dữ liệu ko khớp
     def removeIfHistoryObsolete(
         self, competition_num: int, contest_type: Literal["algo", "heuristic"]
     ):
-        file = COMPETITION_HISTORY.format(
-            contest_type=contest_type, username=self.username
+        local_competition_history = history_store().load(contest_type, self.username)
+        if local_competition_history is not None and (
+            len(local_competition_history) != competition_num
+        ):
+            print(f"Remove obsolete {contest_type} history of {self.username}")
+            history_store().delete(contest_type, self.username)
+
+
+# Fetch song song lịch sử thi đấu của nhiều user, lịch sử fetch được sẽ được lưu lại 1 lần
+# User fetch lỗi không được lưu, lịch sử của các user khác vẫn được giữ lại
+# @return (lịch sử của user fetch được, lỗi của user fetch lỗi)
+def fetch_competition_histories(
+    usernames: list[str], contest_type: Literal["algo", "heuristic"]
+) -> tuple[dict[str, CompetitionHistory], dict[str, Exception]]:
+    histories, errors = fetch_each_concurrently(
+        lambda username: User(username).fetch_competition_history(contest_type),
+        usernames,
+    )
+    history_store().upsert_many(contest_type, histories)
+    if len(errors) > 0:
+        print(
+            f"Failed to fetch {len(errors)} {contest_type} histories: "
+            + ", ".join(f"{username} ({e})" for username, e in list(errors.items())[:5])
         )
-        if os.path.exists(file):
-            local_competition_history = self.competition_history(contest_type)
-            if (
-                len(local_competition_history.get("RoundedPerformance"))
-                != competition_num
-            ):
-                print(f"Remove obsolete history file {file}")
-                os.remove(file)
+    return histories, errors
+
+
+# Lấy lịch sử thi đấu của nhiều user cùng lúc
+# Load 1 lần từ store, user chưa có (hoặc refresh = True) sẽ được fetch song song rồi lưu lại 1 lần
+def competition_histories(
+    usernames: list[str],
+    contest_type: Literal["algo", "heuristic"],
+    refresh: bool = False,
+) -> dict[str, CompetitionHistory]:
+    histories = {} if refresh else history_store().load_many(contest_type, usernames)
+    missing = [username for username in usernames if username not in histories]
+    if len(missing) > 0:
+        with metrics.stage("fetch_histories"):
+            fetched, errors = fetch_competition_histories(missing, contest_type)
+        histories.update(fetched)
+        # Lịch sử fetch được đã được lưu, lần gọi sau chỉ phải fetch lại những user lỗi
+        if len(errors) > 0:
+            raise Exception(
+                f"ERROR: failed to fetch {len(errors)} {contest_type} histories"
+            )
+    return {username: histories[username] for username in usernames}
+
+
+# Giống competition_histories nhưng load theo từng lô
+# Dùng khi chỉ cần duyệt qua 1 lần, không phải giữ lịch sử của toàn bộ user trong bộ nhớ
+def iter_competition_histories(
+    usernames: list[str],
+    contest_type: Literal["algo", "heuristic"],
+    batch_size: int = 1000,
+) -> Iterator[tuple[str, CompetitionHistory]]:
+    for i in range(0, len(usernames), batch_size):
+        batch = usernames[i : i + batch_size]
+        histories = competition_histories(batch, contest_type)
+        for username in batch:
+            yield username, histories[username]
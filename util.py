@@ -1,9 +1,199 @@
+import atexit
+import hashlib
+import json
+import os
 import subprocess
+import threading
+import time
 from os import getenv
 
+from dotenv import load_dotenv
+
+from metrics import metrics
+
+load_dotenv()
+
+# Các lần commit trong khoảng thời gian này được gộp thành 1 commit + 1 lần push
+PUBLISH_WINDOW = int(getenv("PUBLISH_WINDOW", 30))  # seconds
+PUSH_RETRY = 5
+
+
+class GitPublisher:
+    """
+    Commit + push lên github ở 1 thread riêng để các job không phải chờ git
+    Các yêu cầu commit trong PUBLISH_WINDOW giây được gộp lại, chỉ add những file thực sự thay đổi
+    Push lỗi thì thử lại ở thread này, lần publish sau sẽ push luôn những commit còn tồn đọng
+    """
+
+    def __init__(self, window: int = PUBLISH_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.messages: list[str] = []
+        self.push_pending = False
+        self.event = threading.Event()
+        self.thread: threading.Thread | None = None
+
+    def publish(self, message: str) -> None:
+        with self.lock:
+            self.messages.append(message)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+        self.event.set()
+
+    def _loop(self) -> None:
+        while True:
+            self.event.wait()
+            time.sleep(self.window)
+            self.event.clear()
+            self.flush()
+
+    @metrics.timed("git")
+    def flush(self) -> None:
+        with self.flush_lock:
+            with self.lock:
+                messages, self.messages = self.messages, []
+            if len(messages) > 0 and self._commit(messages):
+                self.push_pending = True
+            if self.push_pending:
+                self.push_pending = not self._push()
+
+    @staticmethod
+    def _changed_files() -> list[str]:
+        res = subprocess.run(
+            ["git", "status", "--porcelain", "-z", "--untracked-files=all"],
+            capture_output=True,
+            text=True,
+        )
+        files: list[str] = []
+        entries = iter(res.stdout.split("\0"))
+        for entry in entries:
+            if len(entry) < 4:
+                continue
+            files.append(entry[3:])
+            # Rename: đường dẫn cũ nằm ở entry tiếp theo
+            if entry[0] == "R":
+                files.append(next(entries))
+        return files
+
+    def _commit(self, messages: list[str]) -> bool:
+        files = self._changed_files()
+        if len(files) == 0:
+            return False
+        subprocess.run(["git", "add", "-A", "--", *files])
+        if len(messages) == 1:
+            message = messages[0]
+        else:
+            message = f"Publish {len(messages)} updates\n\n" + "\n".join(
+                f"- {m}" for m in dict.fromkeys(messages)
+            )
+        return subprocess.run(["git", "commit", "-m", message]).returncode == 0
+
+    @staticmethod
+    def _push() -> bool:
+        for retry_count in range(PUSH_RETRY):
+            if subprocess.run(["git", "push"]).returncode == 0:
+                return True
+            print(f"git push failed. Retries {retry_count + 1} times")
+            time.sleep(2 * pow(2, retry_count))
+        return False
+
+
+publisher = GitPublisher()
+
+# Digest của nội dung đã ghi gần nhất của từng file
+_written_digests: dict[str, str] = {}
+
+
+def write_json_if_changed(file: str, data, **kwargs) -> bool:
+    """
+    Ghi data ra file dạng json (kwargs giống json.dump), bỏ qua nếu nội dung không đổi so với lần ghi trước
+    Ghi ra file tạm rồi rename để client không đọc phải file ghi dở
+    @return True nếu file đã được ghi lại
+    """
+    return write_bytes_if_changed(file, json.dumps(data, **kwargs).encode())
+
+
+# Quên digest đã nhớ, lần ghi tiếp theo sẽ so sánh với nội dung file hiện tại
+# Dùng khi file có thể đã bị process khác ghi lại
+def reset_written_digests() -> None:
+    _written_digests.clear()
+
+
+# Xóa file được ghi bằng các hàm *_if_changed, digest cũng bị xóa để lần ghi sau không bị bỏ qua
+def remove_written_file(file: str) -> None:
+    os.remove(file)
+    _written_digests.pop(file, None)
+
+
+def _previous_digest(file: str) -> str | None:
+    if file not in _written_digests and os.path.exists(file):
+        digest = hashlib.sha256()
+        with open(file, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        _written_digests[file] = digest.hexdigest()
+    return _written_digests.get(file)
+
+
+# Giống write_json_if_changed nhưng ghi thẳng bytes
+def write_bytes_if_changed(file: str, payload: bytes) -> bool:
+    digest = hashlib.sha256(payload).hexdigest()
+    if _previous_digest(file) == digest:
+        return False
+
+    tmp = f"{file}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(payload)
+    os.replace(tmp, file)
+    _written_digests[file] = digest
+    metrics.inc("acperf_bytes_written_total", len(payload))
+    return True
+
+
+class JsonObjectStreamWriter:
+    """
+    Ghi 1 json object theo từng cặp key-value thay vì phải có cả dict trong bộ nhớ
+    Nội dung giống hệt json.dump(dict), được ghi ra file tạm và chỉ rename khi khác lần ghi trước
+    """
+
+    def __init__(self, file: str):
+        self.file = file
+        self.tmp = f"{file}.{threading.get_ident()}.tmp"
+        self.f = open(self.tmp, "wb")
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.empty = True
+        self._write(b"{")
+
+    def _write(self, chunk: bytes) -> None:
+        self.f.write(chunk)
+        self.digest.update(chunk)
+        self.size += len(chunk)
+
+    def add(self, key: str, value) -> None:
+        separator = b"" if self.empty else b", "
+        self._write(
+            separator + json.dumps(key).encode() + b": " + json.dumps(value).encode()
+        )
+        self.empty = False
+
+    # Return True nếu file đã được ghi lại
+    def close(self) -> bool:
+        self._write(b"}")
+        self.f.close()
+        digest = self.digest.hexdigest()
+        if _previous_digest(self.file) == digest:
+            os.remove(self.tmp)
+            return False
+        os.replace(self.tmp, self.file)
+        _written_digests[self.file] = digest
+        metrics.inc("acperf_bytes_written_total", self.size)
+        return True
+
 
 def commit_to_github(message: str = "auto commit") -> None:
     if getenv("DEBUG") == '0':
-        subprocess.run(["git", "add", "."])
-        subprocess.run(["git", "commit", "-m", message])
-        subprocess.run(["git", "push"])
+        publisher.publish(message)
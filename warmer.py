@@ -0,0 +1,101 @@
+import os
+import time
+from datetime import datetime, timezone
+from os import getenv
+
+import schedule
+from dotenv import load_dotenv
+
+from aperf import AperfTable
+from constants import KNOWN_USERNAMES
+from contest import Contest
+from history_store import history_store
+from user import fetch_competition_histories
+
+load_dotenv()
+
+# Số user tối đa được fetch lịch sử thi đấu trong 1 lần warm
+WARM_BUDGET = int(getenv("WARM_BUDGET", 2000))
+# Lịch sử được ghi lâu hơn khoảng thời gian này (giây) thì fetch lại
+WARM_MAX_AGE = int(getenv("WARM_MAX_AGE", 7 * 24 * 60 * 60))
+# Số user được lưu vào store sau mỗi lần fetch song song
+WARM_BATCH_SIZE = 100
+
+
+def known_usernames() -> list[str]:
+    if not os.path.exists(KNOWN_USERNAMES):
+        return []
+    with open(KNOWN_USERNAMES, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def warm_candidates(contest: Contest, max_age: int = WARM_MAX_AGE) -> list[str]:
+    """
+    Danh sách user cần fetch lại lịch sử thi đấu trước khi contest bắt đầu, theo thứ tự ưu tiên:
+    user đã đăng ký contest rồi tới user trong KNOWN_USERNAMES,
+    trong mỗi nhóm user chưa có lịch sử trước, sau đó tới lịch sử cũ nhất
+    Rated participant chưa có lịch sử đã được job generate_performance_files trước contest fetch nên bị bỏ qua
+    Lịch sử được ghi trước khi store có cột updated_at không bị coi là cũ
+    """
+    standings = contest.standings_snapshot()
+    registered = [] if standings is None else standings.participants
+    registered_set = set(registered)
+    fetched_by_prediction = (
+        set() if standings is None else set(standings.rated_participants)
+    )
+    groups = [
+        registered,
+        [username for username in known_usernames() if username not in registered_set],
+    ]
+
+    cutoff = time.time() - max_age
+    candidates: list[str] = []
+    for usernames in groups:
+        updated_at = history_store().updated_at_many(contest.type, usernames)
+        candidates += [
+            username
+            for username in usernames
+            if username not in updated_at and username not in fetched_by_prediction
+        ]
+        stale = [
+            username
+            for username in usernames
+            if updated_at.get(username) is not None and updated_at[username] < cutoff
+        ]
+        candidates += sorted(stale, key=lambda username: updated_at[username])
+    return candidates
+
+
+def warm_competition_histories(
+    contest: Contest, budget: int = WARM_BUDGET
+) -> None | schedule.CancelJob:
+    """
+    Fetch trước lịch sử thi đấu của những user có khả năng tham gia contest
+    để lần chạy generate_performance_files đầu tiên không phải fetch từng user
+    aperf của user có lịch sử vừa được ghi lại sẽ được tính lại ở lần chạy generate_performance_files sau
+    Dừng lại khi hết budget hoặc contest đã bắt đầu, job bị hủy khi không còn user nào cần fetch
+    """
+    candidates = warm_candidates(contest)
+    print(
+        f"Warming {min(len(candidates), budget)}/{len(candidates)} {contest.type} histories before {contest.short_name}"
+    )
+    if len(candidates) == 0:
+        return schedule.CancelJob
+
+    table = AperfTable(contest.type)
+    candidates = candidates[:budget]
+    for i in range(0, len(candidates), WARM_BATCH_SIZE):
+        if datetime.now().astimezone(timezone.utc) >= contest.start_time:
+            print(f"{contest.short_name} has started, stop warming")
+            return schedule.CancelJob
+
+        batch = candidates[i : i + WARM_BATCH_SIZE]
+        # User fetch lỗi vẫn còn thiếu lịch sử, lần warm sau sẽ được fetch lại
+        histories, _ = fetch_competition_histories(batch, contest.type)
+        table.upsert(
+            {
+                username: AperfTable.entry(history)
+                for username, history in histories.items()
+            }
+        )
+        contest.forget_aperfs(list(histories))